@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 2.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1, budget: int = None):
+        # rate <= 0 disables pacing; budget caps the total number of requests.
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.budget = budget
+        self.spent = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        while True:
+            with self._lock:
+                if self.budget is not None and self.spent >= self.budget:
+                    return False
+                if self.rate <= 0:
+                    self.spent += 1
+                    return True
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.spent += 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def backoff_delay(attempt: int, base: float = DEFAULT_BACKOFF, cap: float = MAX_BACKOFF) -> float:
+    # "Full jitter": spread retries uniformly so parallel workers don't retry in lockstep.
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def fetch_ordered(items, fetch, workers: int = DEFAULT_WORKERS, limiter: TokenBucket = None, retries: int = DEFAULT_RETRIES, should_retry=None, backoff: float = DEFAULT_BACKOFF):
+    # Yields fetch(item) for each item in input order, so callers can write results
+    # as they arrive. None means the limiter's budget ran out before the item was sent.
+    def attempt(item):
+        for n in range(retries + 1):
+            if limiter is not None and not limiter.acquire():
+                return None
+            result = fetch(item)
+            if n == retries or should_retry is None or not should_retry(result):
+                return result
+            time.sleep(backoff_delay(n, backoff))
+
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield attempt(item)
+        return
+    # At most 2 * workers items are in flight or waiting to be consumed, so a
+    # consumer that falls behind holds back new requests.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(attempt, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # A consumer that stops early (or raises) should not pay for
+            # requests it will never read.
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import gzip
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+import zlib
+
+DEFAULT_TIMEOUT = 30
+# Idle keep-alive connections kept per (scheme, host, port).
+DEFAULT_MAX_IDLE = 8
+# Errors that mean a pooled keep-alive socket was closed under us.
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError)
+
+
+class HttpResponse:
+    def __init__(self, status: int, reason: str, headers: dict, body: bytes, elapsed: float):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.elapsed = elapsed
+
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.text())
+
+
+class HttpClient:
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, max_idle: int = DEFAULT_MAX_IDLE):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.bytes_wire = 0
+        self.bytes_body = 0
+        self.latencies = []
+
+    def _acquire(self, key, timeout: float, fresh: bool = False):
+        with self._lock:
+            pool = self._idle.get(key)
+            if pool and not fresh:
+                conn = pool.pop()
+                self.reused += 1
+                return conn, True
+            self.connections += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            pool = self._idle.setdefault(key, [])
+            if len(pool) < self.max_idle:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def request(self, url: str, headers: dict = None, timeout: float = None) -> HttpResponse:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        send_headers = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+        send_headers.update(headers or {})
+        timeout = self.timeout if timeout is None else timeout
+
+        started = time.perf_counter()
+        for attempt in range(2):
+            conn, reused = self._acquire(key, timeout, fresh=attempt > 0)
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request("GET", path, headers=send_headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except STALE_ERRORS:
+                conn.close()
+                # A reused socket may have been dropped by the server; retry once on a fresh one.
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+        elapsed = time.perf_counter() - started
+
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        encoding = resp_headers.get("content-encoding", "").lower()
+        if encoding == "gzip":
+            body = gzip.decompress(raw)
+        elif encoding == "deflate":
+            body = zlib.decompress(raw)
+        else:
+            body = raw
+        with self._lock:
+            self.requests += 1
+            self.bytes_wire += len(raw)
+            self.bytes_body += len(body)
+            self.latencies.append(elapsed)
+        return HttpResponse(resp.status, resp.reason, resp_headers, body, elapsed)
+
+    def summary(self) -> str:
+        with self._lock:
+            if not self.requests:
+                return "HTTP: no requests"
+            lat = sorted(self.latencies)
+            total = sum(lat)
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+            return (
+                f"HTTP: {self.requests} requests, {self.connections} connections ({self.reused} reused), "
+                f"avg {total / len(lat) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, total {total:.2f}s, "
+                f"{self.bytes_wire} bytes on wire ({self.bytes_body} decoded)"
+            )
+
+    def close(self):
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle = {}
+        for pool in pools:
+            for conn in pool:
+                conn.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    # One process-wide client so every fetch path shares the same keep-alive pool.
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient()
+        return _shared
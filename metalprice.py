@@ -0,0 +1,1148 @@
+#!/usr/bin/env python3
+import argparse
+import http.client
+import json
+import math
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+import fetchpool
+import httpclient
+import quota
+import schema
+import store
+
+# Loaded from metalprice.api
+API_KEY = ""
+# If you move the key file, update this path.
+KEY_FILENAME = "metalprice.api"
+# MetalpriceAPI base URL (US region)
+BASE_URL = "https://api.metalpriceapi.com/v1"
+DEFAULT_DATE = "2026-01-30"
+DEFAULT_BASE = "USD"
+DEFAULT_SYMBOLS = "XAU,XAG"
+DEFAULT_VERBOSE = True
+DEFAULT_CACHE = True
+DEFAULT_BULK = True
+# Longest span the /v1/timeframe endpoint accepts in one request.
+TIMEFRAME_MAX_DAYS = 365
+SOURCE = "metalpriceapi"
+# Negative-cache lifetime per failure class, in seconds (None = never expires).
+FAILURE_TTLS = {
+    "no_data": None,  # provider has nothing for a settled past date
+    "not_published": 6 * 3600,  # today/yesterday may still be published
+    "no_rate": 7 * 86400,  # response came back without this symbol
+    "transient": 15 * 60,  # 5xx, timeouts, network errors
+    "unknown": 86400,  # any other error on a settled date
+}
+# Requests the MetalpriceAPI plan allows per UTC calendar month, 0 for no cap.
+# Every run's budget is capped by what the quota ledger says is left of it.
+MONTHLY_QUOTA = int(os.getenv("METALPRICE_MONTHLY_QUOTA", "").strip() or 0)
+# Days after which a date counts as settled for the provider.
+SETTLE_DAYS = 2
+# Cached prices for the last REVALIDATE_DAYS days are fetched again if they were
+# fetched before their UTC day ended plus CLOSE_GRACE seconds; the provider may
+# still revise a close in that window. Older rows are never re-checked.
+REVALIDATE_DAYS = SETTLE_DAYS
+CLOSE_GRACE = 6 * 3600
+# Failures about the account (auth, plan, quota) say nothing about the date.
+ACCOUNT_ERROR_CODES = {101, 102, 103, 104, 105, 401, 403, 429}
+# Failures about the request itself (invalid base or currency codes); they say
+# nothing about the date and would poison every symbol in the request.
+REQUEST_ERROR_CODES = {201, 202}
+# The provider's "no results for this request"; the only error that marks a
+# settled date as having no data for good.
+NO_DATA_CODES = {106}
+# Failures meaning the endpoint itself is unknown or not in the plan; only these
+# send a failed /timeframe window down the per-day path.
+UNSUPPORTED_ENDPOINT_CODES = {103, 105, 404}
+# Most rows the writer thread commits in one transaction, and how many such
+# batches may wait in its queue before fetch results are held back.
+WRITE_BATCH_ROWS = 500
+WRITE_QUEUE_BATCHES = 4
+# Intraday snapshots are keyed by the provider's timestamp floored to this many seconds.
+SNAPSHOT_BUCKET = 3600
+
+
+def build_url(date_str: str, base: str, symbols) -> str:
+    params = {
+        "api_key": API_KEY,
+        "base": base,
+        "currencies": ",".join(symbols),
+    }
+    query = urllib.parse.urlencode(params)
+    # Historical endpoint is /v1/{date}
+    return f"{BASE_URL}/{date_str}?{query}"
+
+
+def build_timeframe_url(start_str: str, end_str: str, base: str, symbols) -> str:
+    params = {
+        "api_key": API_KEY,
+        "start_date": start_str,
+        "end_date": end_str,
+        "base": base,
+        "currencies": ",".join(symbols),
+    }
+    query = urllib.parse.urlencode(params)
+    # Timeframe endpoint returns one rates dict per day for the whole span
+    return f"{BASE_URL}/timeframe?{query}"
+
+
+def build_latest_url(base: str, symbols) -> str:
+    params = {
+        "api_key": API_KEY,
+        "base": base,
+        "currencies": ",".join(symbols),
+    }
+    query = urllib.parse.urlencode(params)
+    return f"{BASE_URL}/latest?{query}"
+
+
+def mask_key(url: str) -> str:
+    if API_KEY:
+        return url.replace(API_KEY, "****")
+    return url
+
+
+def fetch_json(url: str, verbose: bool) -> dict:
+    if verbose:
+        print(f"Fetching: {mask_key(url)}", file=sys.stderr)
+    quota.spend(SOURCE)
+    try:
+        resp = httpclient.get_client().request(
+            url,
+            headers={
+                "Accept": "application/json",
+                # Cloudflare blocks urllib's default UA; use a real browser UA.
+                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+                "Accept-Language": "en-US,en;q=0.9",
+                # MetalpriceAPI supports API key via header; keep query param too for now.
+                "X-API-Key": API_KEY,
+            },
+            timeout=30,
+        )
+    except (OSError, http.client.HTTPException) as e:
+        return {"success": False, "error": {"code": "network", "info": str(e)}}
+    if resp.status < 400:
+        return resp.json()
+    body = ""
+    try:
+        body = resp.text()
+    except Exception:
+        body = ""
+    if body:
+        try:
+            return json.loads(body)
+        except Exception:
+            return {"success": False, "error": {"code": resp.status, "info": body}}
+    return {"success": False, "error": {"code": resp.status, "info": resp.reason}}
+
+
+def error_code(data: dict):
+    err = data.get("error") or {}
+    if not isinstance(err, dict):
+        return None
+    return err.get("code", err.get("statusCode"))
+
+
+def is_retryable(data: dict) -> bool:
+    if data.get("success", True):
+        return False
+    code = error_code(data)
+    if code == "network":
+        return True
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return False
+    return code == 429 or code >= 500
+
+
+def error_code_int(data: dict):
+    try:
+        return int(error_code(data))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_failure(data: dict, date_str: str):
+    # Returns the FAILURE_TTLS class for a failed response, or None when the
+    # failure must not be negative-cached.
+    if is_retryable(data):
+        return None if error_code(data) == 429 else "transient"
+    code = error_code_int(data)
+    if code in ACCOUNT_ERROR_CODES or code in REQUEST_ERROR_CODES:
+        return None
+    age = schema.to_day(datetime.utcnow().date()) - schema.to_day(date_str)
+    if age < SETTLE_DAYS:
+        return "not_published"
+    return "no_data" if code in NO_DATA_CODES else "unknown"
+
+
+def fetch_price(date_str: str, base: str, symbols, verbose: bool) -> dict:
+    return fetch_json(build_url(date_str, base, symbols), verbose)
+
+
+def fetch_timeframe(start_str: str, end_str: str, base: str, symbols, verbose: bool) -> dict:
+    return fetch_json(build_timeframe_url(start_str, end_str, base, symbols), verbose)
+
+
+def fetch_latest(base: str, symbols, verbose: bool) -> dict:
+    return fetch_json(build_latest_url(base, symbols), verbose)
+
+
+def date_range(start_dt: datetime, end_dt: datetime):
+    days = []
+    cur = start_dt
+    while cur <= end_dt:
+        days.append(cur.strftime("%Y-%m-%d"))
+        cur += timedelta(days=1)
+    return days
+
+
+def coalesce_runs(days, max_days: int = TIMEFRAME_MAX_DAYS):
+    # Group sorted YYYY-MM-DD strings into windows spanning at most max_days, so
+    # every window is one /timeframe request. Windows are opened greedily at the
+    # first uncovered day, which needs the fewest requests; cached days in
+    # between come back too but cost nothing extra.
+    runs = []
+    first = None
+    for d in days:
+        cur = schema.to_day(d)
+        if runs and cur - first < max_days:
+            runs[-1].append(d)
+        else:
+            runs.append([d])
+            first = cur
+    return runs
+
+
+def plan_requests(missing: dict, symbols, max_days: int = TIMEFRAME_MAX_DAYS):
+    # missing maps date -> symbols still needed. Returns [(days, symbols)], one
+    # /timeframe request per window asking for every symbol with a gap in it.
+    runs = coalesce_runs(sorted(missing), max_days)
+    return [(run, [s for s in symbols if any(s in missing[d] for d in run)]) for run in runs]
+
+
+def split_timeframe(data: dict, base: str) -> dict:
+    # Fan a timeframe response out into per-day payloads shaped like /v1/{date},
+    # so cached rows look the same whichever endpoint produced them.
+    days = {}
+    if not data.get("success", True):
+        return days
+    for date_str, day_rates in (data.get("rates") or {}).items():
+        if not isinstance(day_rates, dict):
+            continue
+        days[date_str] = {
+            "success": True,
+            "base": data.get("base", base),
+            "date": date_str,
+            "rates": day_rates,
+        }
+    return days
+
+
+def extract_rate(data: dict, symbol: str):
+    rates = data.get("rates") or data.get("rate") or {}
+    if symbol in rates:
+        return rates[symbol]
+    # Some APIs return USDXXX-style keys
+    alt_key = f"USD{symbol}"
+    return rates.get(alt_key)
+
+
+def quote_of(base: str, symbol: str, rate):
+    # (pair, value) for the quotes table: the metal priced in USD whichever
+    # direction it was requested in (XAUUSD), otherwise the symbol in the base.
+    base = base.upper()
+    symbol = symbol.upper()
+    if not rate:
+        return None
+    if symbol == "USD":
+        return f"{base}USD", float(rate)
+    return f"{symbol}{base}", 1.0 / float(rate)
+
+
+def usd_pair_of(base: str, symbol: str):
+    # The quotes pair holding the metal's USD price (XAUUSD), or None when the
+    # price is not quoted against USD.
+    pair = quote_of(base, symbol, 1)[0]
+    return pair if pair.endswith("USD") else None
+
+
+def iter_prices(conn: sqlite3.Connection, start_str: str, end_str: str, base: str, symbol: str, source: str):
+    # Streams (date, rate, usd_value) in date order without touching raw
+    # payloads; usd_value comes from the metal's USD quote for the same day.
+    cur = conn.execute(
+        """
+        SELECT m.day, m.rate, q.value FROM metal_prices m
+        LEFT JOIN quotes q ON q.pair = ? AND q.day = m.day AND q.source = m.source
+        WHERE m.day BETWEEN ? AND ? AND m.base = ? AND m.symbol = ? AND m.source = ?
+        ORDER BY m.day
+        """,
+        (usd_pair_of(base, symbol), schema.to_day(start_str), schema.to_day(end_str), base, symbol, source),
+    )
+    for day, rate, usd in cur:
+        yield schema.from_day(day), rate, usd
+
+
+def load_raw(conn: sqlite3.Connection, date_str: str, base: str, symbol: str, source: str):
+    # Needs the payload archive attached (schema.attach_payloads).
+    row = conn.execute(
+        f"""
+        SELECT p.body FROM metal_prices m
+        JOIN {schema.PAYLOADS_SCHEMA}.raw_payloads p ON p.hash = m.raw_hash
+        WHERE m.day = ? AND m.base = ? AND m.symbol = ? AND m.source = ?
+        """,
+        (schema.to_day(date_str), base, symbol, source),
+    ).fetchone()
+    return json.loads(schema.unpack_payload(row[0])) if row else None
+
+
+def get_cached_price(conn: sqlite3.Connection, date_str: str, base: str, symbol: str, source: str):
+    # (rate, data, usd_value) for one day, or None. The archived payload is
+    # only decoded when there is no USD quote to go with the rate.
+    rows = list(iter_prices(conn, date_str, date_str, base, symbol, source))
+    if not rows:
+        return None
+    _, rate, usd = rows[0]
+    data = load_raw(conn, date_str, base, symbol, source) if usd is None else None
+    return rate, data, usd
+
+
+def get_cached_range(conn: sqlite3.Connection, start_str: str, end_str: str, base: str, symbol: str, source: str) -> dict:
+    # {date: rate} from one range scan; the cache check only needs the rate.
+    return {d: rate for d, rate, _ in iter_prices(conn, start_str, end_str, base, symbol, source)}
+
+
+def revalidation_window(now: int, window_days: int = REVALIDATE_DAYS):
+    # (first, last) day numbers still open to revalidation: the last
+    # window_days UTC days, today included.
+    today = now // 86400
+    return today - window_days + 1, today
+
+
+def get_provisional_dates(conn: sqlite3.Connection, start_str: str, end_str: str, base: str, symbol: str, source: str, now: int, window_days: int):
+    # Cached days inside the revalidation window whose price was fetched before
+    # the day closed (or at an unknown time).
+    first = max(schema.to_day(start_str), revalidation_window(now, window_days)[0])
+    cur = conn.execute(
+        """
+        SELECT day FROM metal_prices
+        WHERE day BETWEEN ? AND ? AND base = ? AND symbol = ? AND source = ?
+          AND (fetched_at IS NULL OR fetched_at < (day + 1) * 86400 + ?)
+        """,
+        (first, schema.to_day(end_str), base, symbol, source, CLOSE_GRACE),
+    )
+    return {schema.from_day(row[0]) for row in cur}
+
+
+def get_failed_dates(conn: sqlite3.Connection, start_str: str, end_str: str, base: str, symbol: str, source: str, now: int):
+    cur = conn.execute(
+        """
+        SELECT day FROM fetch_failures
+        WHERE day BETWEEN ? AND ? AND base = ? AND symbol = ? AND source = ?
+          AND (expires_at IS NULL OR expires_at > ?)
+        """,
+        (schema.to_day(start_str), schema.to_day(end_str), base, symbol, source, now),
+    )
+    return {schema.from_day(row[0]) for row in cur}
+
+
+def insert_failures(conn: sqlite3.Connection, rows):
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO fetch_failures (day, base, symbol, source, error_class, code, info, failed_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+
+def insert_prices(conn: sqlite3.Connection, rows, quotes, payloads: dict):
+    # payloads maps hash -> raw JSON text; identical bodies are stored once.
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {schema.PAYLOADS_SCHEMA}.raw_payloads (hash, body) VALUES (?, ?)",
+        ((h, schema.pack_payload(raw)) for h, raw in payloads.items()),
+    )
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO metal_prices (day, base, symbol, rate, source, raw_hash, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    conn.executemany("INSERT OR REPLACE INTO quotes (day, pair, value, source) VALUES (?, ?, ?, ?)", quotes)
+    if quotes:
+        store.lower_gsp_mark(conn, min(q[0] for q in quotes))
+    # A stored price supersedes any earlier negative result for the same key.
+    conn.executemany(
+        "DELETE FROM fetch_failures WHERE day = ? AND base = ? AND symbol = ? AND source = ?",
+        ((r[0], r[1], r[2], r[4]) for r in rows),
+    )
+
+
+class IngestSession:
+    # Cache lookups go through one store connection on the caller's thread (a
+    # connection passed in is shared with the caller and left open by close()).
+    # Writes never touch it: add() and add_failure() queue rows for a single
+    # writer thread with its own connection, which commits whatever is queued,
+    # up to batch_size rows, per transaction. The queue is bounded, so fetch
+    # results wait (backpressure) instead of piling up when the writer lags.
+    def __init__(self, db_path: str, verbose: bool, batch_size: int = WRITE_BATCH_ROWS, conn: sqlite3.Connection = None):
+        self.db_path = db_path
+        self.verbose = verbose
+        self.batch_size = max(1, batch_size)
+        self.conn = conn
+        self.owns_conn = conn is None
+        self.queue = queue.Queue(maxsize=self.batch_size * WRITE_QUEUE_BATCHES)
+        self.writer = None
+        self.error = None
+        self.rows = 0
+        self.commits = 0
+        self.setup_time = 0.0
+        self.write_time = 0.0
+        self.wait_time = 0.0
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            started = time.perf_counter()
+            self.conn = store.connect(self.db_path, self.verbose)
+            self.setup_time += time.perf_counter() - started
+        return self.conn
+
+    def cached_range(self, start_str: str, end_str: str, base: str, symbol: str, source: str) -> dict:
+        return get_cached_range(self.connect(), start_str, end_str, base, symbol, source)
+
+    def failed_dates(self, start_str: str, end_str: str, base: str, symbol: str, source: str):
+        return get_failed_dates(self.connect(), start_str, end_str, base, symbol, source, int(time.time()))
+
+    def provisional_dates(self, start_str: str, end_str: str, base: str, symbol: str, source: str, window_days: int):
+        return get_provisional_dates(self.connect(), start_str, end_str, base, symbol, source, int(time.time()), window_days)
+
+    def put(self, item):
+        # A dead writer would drain and drop everything; stop the fetch instead.
+        if self.error is not None:
+            raise self.error
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_loop, name="sqlite-writer", daemon=True)
+            self.writer.start()
+        started = time.perf_counter()
+        self.queue.put(item)
+        self.wait_time += time.perf_counter() - started
+
+    def add_failure(self, date_str: str, base: str, symbol: str, source: str, error_class: str, data: dict):
+        now = int(time.time())
+        ttl = FAILURE_TTLS[error_class]
+        err = data.get("error") if isinstance(data.get("error"), dict) else {}
+        code = error_code(data)
+        info = err.get("info", err.get("message"))
+        row = (schema.to_day(date_str), base, symbol, source, error_class, None if code is None else str(code), info, now, None if ttl is None else now + ttl)
+        self.put(("failure", row))
+
+    def add(self, date_str: str, base: str, symbol: str, rate: float, source: str, raw: dict):
+        # Serialising and hashing the payload stays on the fetch side; the
+        # writer only runs SQL.
+        raw_text = json.dumps(raw, separators=(",", ":"))
+        raw_hash = schema.payload_hash(raw_text)
+        day = schema.to_day(date_str)
+        quote = quote_of(base, symbol, rate)
+        row = (day, base, symbol, rate, source, raw_hash, int(time.time()))
+        self.put(("price", row, quote and (day, quote[0], quote[1], source), raw_text))
+
+    def write_loop(self):
+        conn = None
+        done = False
+        try:
+            started = time.perf_counter()
+            conn = store.connect(self.db_path)
+            self.setup_time += time.perf_counter() - started
+            while not done:
+                batch = [self.queue.get()]
+                while batch[-1] is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                self.write(conn, batch)
+        except BaseException as exc:
+            self.error = exc
+            # Keep draining so a fetcher blocked on the full queue can finish.
+            while not done:
+                done = self.queue.get() is None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def write(self, conn: sqlite3.Connection, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        prices, quotes, payloads, failures = [], [], {}, []
+        for item in batch:
+            if item[0] == "failure":
+                failures.append(item[1])
+                continue
+            _, row, quote, raw_text = item
+            prices.append(row)
+            if quote:
+                quotes.append(quote)
+            payloads[row[5]] = raw_text
+        insert_failures(conn, failures)
+        insert_prices(conn, prices, quotes, payloads)
+        quota.flush(conn)
+        conn.commit()
+        self.rows += len(prices)
+        self.commits += 1
+        self.write_time += time.perf_counter() - started
+        if self.verbose:
+            print(f"Saved {len(prices)} row(s) to SQLite: {self.db_path}", file=sys.stderr)
+
+    def close(self):
+        try:
+            if self.writer is not None:
+                self.queue.put(None)
+                self.writer.join()
+                self.writer = None
+            # Requests whose responses wrote nothing still count.
+            quota.flush(self.connect())
+            self.conn.commit()
+        finally:
+            if self.conn is not None and self.owns_conn:
+                self.conn.close()
+                self.conn = None
+        if self.verbose:
+            print(
+                f"SQLite: {self.rows} rows in {self.commits} commit(s); "
+                f"schema setup {self.setup_time * 1000:.1f} ms, writes {self.write_time * 1000:.1f} ms, "
+                f"waited {self.wait_time * 1000:.1f} ms on the writer",
+                file=sys.stderr,
+            )
+        if self.error is not None:
+            raise self.error
+
+
+def monthly_budget(conn: sqlite3.Connection, budget: int, monthly_quota: int):
+    # budget (0 = no cap) further capped by what is left of monthly_quota this
+    # month; None once the month's quota is spent.
+    if not monthly_quota:
+        return budget
+    left = monthly_quota - quota.usage(conn, SOURCE)[1]
+    if left <= 0:
+        return None
+    return min(budget, left) if budget else left
+
+
+def check_cache(session: IngestSession, days, symbols, base: str, use_cache: bool = DEFAULT_CACHE, revalidate_days: int = REVALIDATE_DAYS):
+    # Reads the whole range once per symbol. Returns the hits [(date, symbol,
+    # rate)], the pairs in the negative cache [(date, symbol)], {date: [symbols
+    # still missing]} for the days that have gaps, and how many of those gaps
+    # are provisional cached prices due for revalidation.
+    hits = {}
+    failed = {}
+    stale = 0
+    for symbol in symbols:
+        if use_cache:
+            hits[symbol] = session.cached_range(days[0], days[-1], base, symbol, SOURCE)
+            failed[symbol] = session.failed_dates(days[0], days[-1], base, symbol, SOURCE)
+            if revalidate_days > 0:
+                for d in session.provisional_dates(days[0], days[-1], base, symbol, SOURCE, revalidate_days):
+                    stale += hits[symbol].pop(d, None) is not None
+        else:
+            hits[symbol] = {}
+            failed[symbol] = set()
+    found = []
+    known = []
+    missing = {}
+    for d in days:
+        for symbol in symbols:
+            rate = hits[symbol].get(d)
+            if rate is not None:
+                found.append((d, symbol, rate))
+            elif d in failed[symbol]:
+                known.append((d, symbol))
+            else:
+                missing.setdefault(d, []).append(symbol)
+    return found, known, missing, stale
+
+
+def show_plan(
+    session: IngestSession,
+    days,
+    symbols,
+    base: str = DEFAULT_BASE,
+    use_cache: bool = DEFAULT_CACHE,
+    use_bulk: bool = DEFAULT_BULK,
+    revalidate_days: int = REVALIDATE_DAYS,
+) -> int:
+    # Dry run: what ingest() would send for days x symbols, per-day vs bulk and
+    # shared vs one symbol per request, next to the requests already spent.
+    # Returns the cost of the plan ingest() would pick.
+    hits, known, missing, stale = check_cache(session, days, symbols, base, use_cache, revalidate_days)
+    gaps = sorted(missing)
+    wanted = sum(len(v) for v in missing.values())
+    bulk = len(plan_requests(missing, symbols)) if gaps else 0
+    bulk_alone = sum(len(plan_requests({d: [s] for d in gaps if s in missing[d]}, [s])) for s in symbols)
+    chosen = bulk if use_bulk and len(gaps) > 1 else len(gaps)
+    on_day, in_month = quota.usage(session.connect(), SOURCE)
+    print(
+        f"Plan for {days[0]}..{days[-1]} x {','.join(symbols)}: {len(hits)} cached, "
+        f"{len(known)} known unavailable, {wanted} to fetch ({stale} provisional) over {len(gaps)} day(s)"
+    )
+    print(f"  per-day requests: {len(gaps)} shared across symbols, {wanted} one symbol each")
+    print(f"  bulk requests:    {bulk} shared across symbols, {bulk_alone} one symbol each")
+    print(f"  this run would send {chosen} request(s), plus per-day retries for days a bulk response lacks")
+    print(f"  {SOURCE} spent so far: {on_day} request(s) today, {in_month} this month (UTC)")
+    return chosen
+
+
+def ingest(
+    session: IngestSession,
+    days,
+    symbols,
+    base: str = DEFAULT_BASE,
+    use_cache: bool = DEFAULT_CACHE,
+    use_bulk: bool = DEFAULT_BULK,
+    revalidate_days: int = REVALIDATE_DAYS,
+    workers: int = fetchpool.DEFAULT_WORKERS,
+    rate_limit: float = fetchpool.DEFAULT_RATE,
+    budget: int = 0,
+    retries: int = fetchpool.DEFAULT_RETRIES,
+    verbose: bool = DEFAULT_VERBOSE,
+    monthly_quota: int = MONTHLY_QUOTA,
+):
+    # Serve days (sorted YYYY-MM-DD strings) x symbols from the store where
+    # possible and fetch the rest into session; the caller closes the session.
+    # Returns the number of requests sent.
+    require_api_key()
+    budget = monthly_budget(session.connect(), budget, monthly_quota)
+    if budget is None:
+        print(f"Skipped: the {SOURCE} monthly quota of {monthly_quota} request(s) is spent.", file=sys.stderr)
+        return 0
+
+    def record(date_str: str, symbol: str, data: dict, rate=None, cached: bool = False) -> bool:
+        if rate is None:
+            rate = extract_rate(data, symbol)
+        if rate is None:
+            print(f"Error: could not find {symbol} rate in response.", file=sys.stderr)
+            print(json.dumps(data, indent=2, ensure_ascii=False))
+            return False
+
+        # Print a simple line for now
+        print(f"{date_str} {symbol}/{base} = {rate}")
+
+        # Cached rows are already stored; only fresh responses are written.
+        if not cached:
+            session.add(date_str, base, symbol, float(rate), SOURCE, data)
+        return True
+
+    skipped = []
+    revalidating = []
+
+    def serve_cached(days):
+        # Record the store hits and return {date: [symbols still missing]} for
+        # the days that have gaps.
+        hits, known, missing, stale = check_cache(session, days, symbols, base, use_cache, revalidate_days)
+        for d, symbol, rate in hits:
+            record(d, symbol, None, rate, cached=True)
+        skipped.extend(known)
+        revalidating.append(stale)
+        return missing
+
+    def remember_failure(date_str: str, symbol: str, data: dict, error_class: str = None):
+        error_class = error_class or classify_failure(data, date_str)
+        if error_class:
+            session.add_failure(date_str, base, symbol, SOURCE, error_class, data)
+
+    def apply(date_str: str, todo, data: dict) -> bool:
+        if data is None:
+            print(f"Skipped {date_str}: request budget exhausted.", file=sys.stderr)
+            return False
+        if not data.get("success", True):
+            print("API error:", json.dumps(data, ensure_ascii=False), file=sys.stderr)
+            for symbol in todo:
+                remember_failure(date_str, symbol, data)
+            return False
+        ok = True
+        for symbol in todo:
+            if not record(date_str, symbol, data):
+                remember_failure(date_str, symbol, data, "no_rate")
+                ok = False
+        return ok
+
+    limiter = fetchpool.TokenBucket(rate_limit, burst=workers, budget=budget or None)
+
+    def fetch_days(work):
+        # work is [(date_str, symbols)]; one request per date carries all its symbols.
+        results = fetchpool.fetch_ordered(
+            work,
+            lambda item: fetch_price(item[0], base, item[1], verbose),
+            workers=workers,
+            limiter=limiter,
+            retries=retries,
+            should_retry=is_retryable,
+        )
+        for (date_str, todo), data in zip(work, results):
+            apply(date_str, todo, data)
+
+    def fetch_runs(work, missing):
+        # One /timeframe request per planned window of gap days.
+        results = fetchpool.fetch_ordered(
+            work,
+            lambda item: fetch_timeframe(item[0][0], item[0][-1], base, item[1], verbose),
+            workers=workers,
+            limiter=limiter,
+            retries=retries,
+            should_retry=is_retryable,
+        )
+        fallback = []
+        for (run, wanted), data in zip(work, results):
+            if data is None:
+                print(f"Skipped {run[0]}..{run[-1]}: request budget exhausted.", file=sys.stderr)
+                continue
+            if not data.get("success", True):
+                print("API error (timeframe):", json.dumps(data, ensure_ascii=False), file=sys.stderr)
+                code = error_code_int(data)
+                if code in ACCOUNT_ERROR_CODES and code not in UNSUPPORTED_ENDPOINT_CODES:
+                    # Auth, plan or quota trouble would fail every per-day call too.
+                    print(f"Stopping at {run[0]}: account error from the provider.", file=sys.stderr)
+                    return
+                if code not in UNSUPPORTED_ENDPOINT_CODES:
+                    # Already retried; asking day by day would only multiply the calls.
+                    print(f"Skipped {run[0]}..{run[-1]}: bulk request failed.", file=sys.stderr)
+                    continue
+            bulk = split_timeframe(data, base)
+            for d in run:
+                have = [s for s in missing[d] if d in bulk and extract_rate(bulk[d], s) is not None]
+                if have:
+                    apply(d, have, bulk[d])
+                # Anything the bulk response lacked goes the per-day way.
+                rest = [s for s in missing[d] if s not in have]
+                if rest:
+                    fallback.append((d, rest))
+        fetch_days(fallback)
+
+    def run(days):
+        missing = serve_cached(days)
+        gaps = sorted(missing)
+        bulk = use_bulk and len(gaps) > 1
+        work = plan_requests(missing, symbols) if bulk else []
+        if verbose:
+            wanted = sum(len(v) for v in missing.values())
+            requests = len(work) if bulk else len(gaps)
+            print(
+                f"Plan: {len(days)} day(s) x {len(symbols)} symbol(s): "
+                f"{len(days) * len(symbols) - wanted - len(skipped)} cached, {len(skipped)} known unavailable, "
+                f"{wanted} to fetch ({sum(revalidating)} provisional) over {len(gaps)} day(s) in {requests} {'bulk ' if bulk else ''}request(s)",
+                file=sys.stderr,
+            )
+        if bulk:
+            fetch_runs(work, missing)
+        else:
+            fetch_days([(d, missing[d]) for d in gaps])
+
+    if days:
+        run(days)
+    return limiter.spent
+
+
+def store_snapshot(conn: sqlite3.Connection, data: dict, base: str, symbols, now: int) -> int:
+    # Adds one /latest response to metal_snapshots. A symbol whose rate equals
+    # its newest stored snapshot is skipped, so a quiet market (or a rerun
+    # within the provider's update interval) stores nothing. Returns rows stored.
+    ts = int(data.get("timestamp") or now)
+    bucket = ts - ts % SNAPSHOT_BUCKET
+    raw_text = json.dumps(data, separators=(",", ":"))
+    raw_hash = schema.payload_hash(raw_text)
+    rows = []
+    for symbol in symbols:
+        rate = extract_rate(data, symbol)
+        if rate is None:
+            continue
+        last = conn.execute(
+            "SELECT rate FROM metal_snapshots WHERE symbol = ? AND base = ? AND source = ? ORDER BY bucket DESC LIMIT 1",
+            (symbol, base, SOURCE),
+        ).fetchone()
+        if last and last[0] == float(rate):
+            continue
+        rows.append((symbol, base, SOURCE, bucket, float(rate), now, raw_hash))
+    if rows:
+        conn.execute(
+            f"INSERT OR IGNORE INTO {schema.PAYLOADS_SCHEMA}.raw_payloads (hash, body) VALUES (?, ?)",
+            (raw_hash, schema.pack_payload(raw_text)),
+        )
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO metal_snapshots (symbol, base, source, bucket, rate, fetched_at, raw_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+    return len(rows)
+
+
+def rollup_snapshots(conn: sqlite3.Connection, base: str, now: int, window_days: int = REVALIDATE_DAYS) -> int:
+    # For every closed UTC day with snapshots but no daily price, the day's last
+    # snapshot becomes its price. It keeps the snapshot's fetched_at, which is
+    # before the day closed, so revalidation replaces it with the provider's
+    # close once that is fetched. Only days still inside the revalidation
+    # window qualify: older ones would never be revisited, so they are left as
+    # gaps for a normal fetch. Returns rows written.
+    # (SQLite takes the bare columns from the row holding MAX(bucket).)
+    cur = conn.execute(
+        """
+        SELECT day, base, symbol, rate, source, raw_hash, fetched_at FROM (
+            SELECT bucket / 86400 AS day, base, symbol, rate, source, raw_hash, fetched_at, MAX(bucket)
+            FROM metal_snapshots
+            WHERE base = ? AND source = ? AND bucket >= ? AND bucket < ?
+            GROUP BY symbol, base, source, bucket / 86400
+        ) s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM metal_prices m
+            WHERE m.day = s.day AND m.base = s.base AND m.symbol = s.symbol AND m.source = s.source
+        )
+        """,
+        (base, SOURCE, revalidation_window(now, window_days)[0] * 86400, now // 86400 * 86400),
+    )
+    rows = cur.fetchall()
+    quotes = []
+    for day, row_base, symbol, rate, source, _, _ in rows:
+        quote = quote_of(row_base, symbol, rate)
+        if quote:
+            quotes.append((day, quote[0], quote[1], source))
+    insert_prices(conn, rows, quotes, {})
+    return len(rows)
+
+
+def take_snapshot(conn: sqlite3.Connection, symbols, base: str = DEFAULT_BASE, verbose: bool = DEFAULT_VERBOSE, monthly_quota: int = MONTHLY_QUOTA, window_days: int = REVALIDATE_DAYS) -> int:
+    # Intraday mode: one /latest request for every symbol, stored as a
+    # snapshot, then closed days rolled up into metal_prices.
+    require_api_key()
+    now = int(time.time())
+    stored = 0
+    if monthly_budget(conn, 0, monthly_quota) is None:
+        print(f"Snapshot skipped: the {SOURCE} monthly quota of {monthly_quota} request(s) is spent.", file=sys.stderr)
+    else:
+        data = fetch_latest(base, symbols, verbose)
+        if data.get("success", True):
+            stored = store_snapshot(conn, data, base, symbols, now)
+        else:
+            print("API error (latest):", json.dumps(data, ensure_ascii=False), file=sys.stderr)
+    rolled = rollup_snapshots(conn, base, now, window_days)
+    quota.flush(conn)
+    conn.commit()
+    if verbose:
+        print(f"Snapshot: {stored} new quote(s), {rolled} closed day(s) rolled up", file=sys.stderr)
+    return stored
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def backfill(
+    conn: sqlite3.Connection,
+    db_path: str,
+    start_dt: datetime,
+    end_dt: datetime,
+    symbols,
+    base: str = DEFAULT_BASE,
+    daily_quota: int = 0,
+    chunk_days: int = TIMEFRAME_MAX_DAYS,
+    budget: int = 0,
+    batch_size: int = WRITE_BATCH_ROWS,
+    verbose: bool = DEFAULT_VERBOSE,
+    **fetch,
+) -> bool:
+    # Ingest [start, end] chunk by chunk, recording the first uncommitted day in
+    # backfill_checkpoints after each one, so a rerun of the same job resumes
+    # there. daily_quota caps the job's requests per UTC day and budget this
+    # run's (0 = no cap). Returns True once the whole range is done.
+    start, end = schema.to_day(start_dt), schema.to_day(end_dt)
+    job = f"{base}:{','.join(symbols)}:{schema.from_day(start)}:{schema.from_day(end)}"
+    today = schema.to_day(datetime.utcnow().date())
+    now = int(time.time())
+    row = conn.execute("SELECT next_day, requests, quota_day, quota_spent FROM backfill_checkpoints WHERE job = ?", (job,)).fetchone()
+    if row is None:
+        conn.execute(
+            """
+            INSERT INTO backfill_checkpoints (job, base, symbols, start_day, end_day, next_day, quota_day, started_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job, base, ",".join(symbols), start, end, start, today, now, now),
+        )
+        conn.commit()
+        next_day, requests, spent = start, 0, 0
+    else:
+        next_day, requests, quota_day, spent = row
+        if quota_day != today:
+            spent = 0
+        if verbose and next_day <= end:
+            print(f"Backfill {job}: resuming at {schema.from_day(next_day)}", file=sys.stderr)
+
+    total = end - start + 1
+    started = time.perf_counter()
+    run_days = 0
+    run_requests = 0
+    while next_day <= end:
+        caps = []
+        if daily_quota:
+            caps.append(daily_quota - spent)
+        if budget:
+            caps.append(budget - run_requests)
+        left = min(caps) if caps else 0
+        if caps and left <= 0:
+            if verbose:
+                reason = "daily quota" if daily_quota and spent >= daily_quota else "run budget"
+                print(f"Backfill {job}: {reason} spent, stopping at {schema.from_day(next_day)}", file=sys.stderr)
+            break
+        chunk_end = min(next_day + chunk_days - 1, end)
+        session = IngestSession(db_path, verbose, batch_size, conn=conn)
+        try:
+            sent = ingest(session, [schema.from_day(d) for d in range(next_day, chunk_end + 1)], symbols, base, budget=left, verbose=verbose, **fetch)
+        finally:
+            session.close()
+        spent += sent
+        requests += sent
+        run_requests += sent
+        # The chunk is done once every day has a price or a recorded failure
+        # that outlives a transient one (counting those as still missing), so
+        # network errors and budget cut-offs are retried from this chunk.
+        settle = int(time.time()) + FAILURE_TTLS["transient"]
+        done = not any(store.missing_days(conn, base, s, SOURCE, next_day, chunk_end, settle) for s in symbols)
+        if done:
+            run_days += chunk_end - next_day + 1
+            next_day = chunk_end + 1
+        conn.execute(
+            """
+            UPDATE backfill_checkpoints
+            SET next_day = ?, requests = ?, quota_day = ?, quota_spent = ?, updated_at = ?
+            WHERE job = ?
+            """,
+            (next_day, requests, today, spent, int(time.time()), job),
+        )
+        conn.commit()
+        if verbose:
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            remaining = end - next_day + 1
+            rate = run_days / elapsed
+            eta = format_duration(remaining / rate) if rate else "?"
+            line = (
+                f"Backfill {job}: {total - remaining}/{total} day(s) ({(total - remaining) / total:.1%}), "
+                f"{rate:.1f} days/s, {run_requests / elapsed:.2f} req/s, ETA {eta}"
+            )
+            if daily_quota and total > remaining and remaining:
+                # At the cost per day seen so far, how many days of quota are left.
+                need = requests / (total - remaining) * remaining
+                line += f", ~{math.ceil(need / daily_quota)} day(s) of quota"
+            print(line, file=sys.stderr)
+        if not done:
+            if verbose:
+                print(f"Backfill {job}: {schema.from_day(next_day)}..{schema.from_day(chunk_end)} incomplete, retrying it next run", file=sys.stderr)
+            break
+    return next_day > end
+
+
+def require_api_key():
+    global API_KEY
+    if not API_KEY:
+        API_KEY = load_api_key()
+
+
+def load_api_key() -> str:
+    key = os.getenv("METALPRICE_API_KEY", "").strip()
+    if not key:
+        key_path = os.path.join(os.path.dirname(__file__), KEY_FILENAME)
+        try:
+            with open(key_path, "r", encoding="utf-8") as f:
+                key = f.read().strip()
+        except FileNotFoundError:
+            print(f"Error: missing API key file: {key_path}", file=sys.stderr)
+            sys.exit(2)
+
+    if not key or key == "PASTE_API_KEY_HERE":
+        print("Error: API key missing. Set METALPRICE_API_KEY or fill metalprice.api.", file=sys.stderr)
+        sys.exit(2)
+    return key
+
+
+def parse_symbols(value: str):
+    symbols = []
+    for part in value.split(","):
+        part = part.strip().upper()
+        if part and part not in symbols:
+            symbols.append(part)
+    return symbols
+
+
+def main(argv=None, description: str = "Fetch historical metal prices from MetalpriceAPI", default_symbols: str = DEFAULT_SYMBOLS):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--date", default=DEFAULT_DATE, help="Date in YYYY-MM-DD (default: 2026-01-30)")
+    parser.add_argument("--start", default="", help="Start date YYYY-MM-DD (optional)")
+    parser.add_argument("--end", default="", help="End date YYYY-MM-DD (optional)")
+    parser.add_argument("--base", default=DEFAULT_BASE, help="Base currency (default: USD)")
+    parser.add_argument(
+        "--symbols",
+        "--symbol",
+        dest="symbols",
+        default=default_symbols,
+        help=f"Comma-separated metal symbols fetched in one request (default: {default_symbols})",
+    )
+    parser.add_argument("--sqlite", default="", help=f"Store path (default: {store.STORE_FILENAME} in --db-dir)")
+    parser.add_argument("--db-dir", default="", help="Directory holding the store (default: current directory)")
+    parser.add_argument("--quiet", action="store_true", help="Disable verbose output")
+    parser.add_argument("--no-cache", action="store_true", help="Disable SQLite cache and force API call")
+    parser.add_argument(
+        "--revalidate-days",
+        type=int,
+        default=REVALIDATE_DAYS,
+        help=f"Re-fetch cached prices of the last N days fetched before the day closed, 0 to trust the cache (default: {REVALIDATE_DAYS})",
+    )
+    parser.add_argument("--no-bulk", action="store_true", help="Fetch ranges one day at a time instead of via /timeframe")
+    parser.add_argument("--workers", type=int, default=fetchpool.DEFAULT_WORKERS, help="Concurrent requests (default: 4)")
+    parser.add_argument("--rate", type=float, default=fetchpool.DEFAULT_RATE, help="Max requests per second, 0 for unlimited (default: 2)")
+    parser.add_argument("--budget", type=int, default=0, help="Max requests this run, 0 for unlimited (default: 0)")
+    parser.add_argument(
+        "--monthly-quota",
+        type=int,
+        default=MONTHLY_QUOTA,
+        help=f"Provider requests allowed per UTC month, 0 for no cap (default: {MONTHLY_QUOTA}, from $METALPRICE_MONTHLY_QUOTA)",
+    )
+    parser.add_argument("--commit-every", type=int, default=WRITE_BATCH_ROWS, help=f"Max rows per write transaction (default: {WRITE_BATCH_ROWS})")
+    parser.add_argument("--retries", type=int, default=fetchpool.DEFAULT_RETRIES, help="Retries for 429/5xx/network errors (default: 3)")
+    parser.add_argument("--latest", action="store_true", help="Store an intraday snapshot from /latest and roll closed days into the daily table")
+    parser.add_argument("--plan", action="store_true", help="Show the request plan and its cost without fetching anything")
+    parser.add_argument("--backfill", action="store_true", help="Resumable backfill of --start..--end, checkpointed in the store")
+    parser.add_argument("--daily-quota", type=int, default=0, help="Backfill: max requests per UTC day across runs, 0 for unlimited (default: 0)")
+    parser.add_argument(
+        "--chunk-days",
+        type=int,
+        default=TIMEFRAME_MAX_DAYS,
+        help=f"Backfill: days committed per checkpoint (default: {TIMEFRAME_MAX_DAYS})",
+    )
+    args = parser.parse_args(argv)
+    verbose = DEFAULT_VERBOSE and not args.quiet
+    use_cache = DEFAULT_CACHE and not args.no_cache
+    use_bulk = DEFAULT_BULK and not args.no_bulk
+
+    symbols = parse_symbols(args.symbols)
+    if not symbols:
+        print("Error: --symbols must name at least one symbol.", file=sys.stderr)
+        sys.exit(2)
+    db_path = args.sqlite or os.path.join(args.db_dir, store.STORE_FILENAME)
+
+    def parse_date(s: str) -> datetime:
+        return datetime.strptime(s, "%Y-%m-%d")
+
+    # Validate date(s)
+    try:
+        if args.start and args.end:
+            start_dt = parse_date(args.start)
+            end_dt = parse_date(args.end)
+        else:
+            start_dt = end_dt = parse_date(args.date)
+    except ValueError:
+        print("Error: date must be in YYYY-MM-DD format.", file=sys.stderr)
+        sys.exit(2)
+
+    if end_dt < start_dt:
+        print("Error: --end must be >= --start.", file=sys.stderr)
+        sys.exit(2)
+    started = time.perf_counter()
+    if args.latest:
+        conn = store.connect(db_path, verbose)
+        try:
+            take_snapshot(conn, symbols, args.base, verbose, monthly_quota=args.monthly_quota, window_days=args.revalidate_days)
+        finally:
+            conn.close()
+        return
+    if args.plan:
+        if not os.path.exists(db_path):
+            print(f"Error: store not found: {db_path}", file=sys.stderr)
+            sys.exit(2)
+        session = IngestSession(db_path, False)
+        try:
+            show_plan(
+                session,
+                date_range(start_dt, end_dt),
+                symbols,
+                args.base,
+                use_cache=use_cache,
+                use_bulk=use_bulk,
+                revalidate_days=args.revalidate_days,
+            )
+        finally:
+            session.close()
+        return
+    if args.backfill:
+        if not (args.start and args.end):
+            print("Error: --backfill needs --start and --end.", file=sys.stderr)
+            sys.exit(2)
+        conn = store.connect(db_path, verbose)
+        try:
+            complete = backfill(
+                conn,
+                db_path,
+                start_dt,
+                end_dt,
+                symbols,
+                args.base,
+                daily_quota=args.daily_quota,
+                chunk_days=max(1, args.chunk_days),
+                budget=args.budget,
+                batch_size=args.commit_every,
+                verbose=verbose,
+                use_cache=use_cache,
+                use_bulk=use_bulk,
+                revalidate_days=args.revalidate_days,
+                workers=args.workers,
+                rate_limit=args.rate,
+                retries=args.retries,
+                monthly_quota=args.monthly_quota,
+            )
+        finally:
+            conn.close()
+        if verbose:
+            print(httpclient.get_client().summary(), file=sys.stderr)
+            print(f"Backfill {'complete' if complete else 'paused; rerun to resume'} after {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        return
+    session = IngestSession(db_path, verbose, args.commit_every)
+    try:
+        ingest(
+            session,
+            date_range(start_dt, end_dt),
+            symbols,
+            args.base,
+            use_cache=use_cache,
+            use_bulk=use_bulk,
+            revalidate_days=args.revalidate_days,
+            workers=args.workers,
+            rate_limit=args.rate,
+            budget=args.budget,
+            retries=args.retries,
+            verbose=verbose,
+            monthly_quota=args.monthly_quota,
+        )
+    finally:
+        session.close()
+    if verbose:
+        print(httpclient.get_client().summary(), file=sys.stderr)
+        print(f"Run took {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
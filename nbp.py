@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import bisect
+import http.client
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import httpclient
+import plcalendar
+import quota
+import schema
+
+NBP_USDPLN_RANGE_URL = "https://api.nbp.pl/api/exchangerates/rates/a/usd/{start}/{end}/?format=json"
+USDPLN = "USDPLN"
+# quotes.source of NBP table A fixings.
+SOURCE = "nbp"
+# NBP rejects date-range queries longer than 93 days.
+NBP_MAX_RANGE_DAYS = 93
+# Fallback bound for as-of lookups when the calendar's expected fixing is missing
+# (an unscheduled NBP closure).
+FIXING_LOOKBACK_DAYS = 7
+# Table A is published around 11:45-12:15 Warsaw time; after this hour today's
+# fixing either exists or never will.
+FIXING_SETTLED_HOUR = 13
+
+
+def plan_ranges(start_str: str, end_str: str, max_days: int = NBP_MAX_RANGE_DAYS):
+    ranges = []
+    cur = datetime.strptime(start_str, "%Y-%m-%d")
+    end = datetime.strptime(end_str, "%Y-%m-%d")
+    while cur <= end:
+        chunk_end = min(cur + timedelta(days=max_days - 1), end)
+        ranges.append((cur.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+        cur = chunk_end + timedelta(days=1)
+    return ranges
+
+
+def fetch_usdpln_range(start_str: str, end_str: str, verbose: bool = False):
+    # Returns {effectiveDate: mid} for every fixing in [start, end], one request
+    # per 93-day chunk. NBP answers 404 for a chunk without any fixing; any other
+    # error (5xx, 429, network) returns None, since the range is then unknown.
+    fixings = {}
+    for chunk_start, chunk_end in plan_ranges(start_str, end_str):
+        url = NBP_USDPLN_RANGE_URL.format(start=chunk_start, end=chunk_end)
+        if verbose:
+            print(f"Fetching: {url}", file=sys.stderr)
+        quota.spend(SOURCE)
+        try:
+            resp = httpclient.get_client().request(
+                url,
+                headers={
+                    "Accept": "application/json",
+                    "User-Agent": "GypStats/1.0",
+                },
+                timeout=20,
+            )
+        except (OSError, http.client.HTTPException) as e:
+            print(f"NBP error for {chunk_start}..{chunk_end}: {e}", file=sys.stderr)
+            return None
+        if resp.status == 404:
+            continue
+        if resp.status >= 400:
+            print(f"NBP error for {chunk_start}..{chunk_end}: HTTP {resp.status} {resp.reason}", file=sys.stderr)
+            return None
+        for item in resp.json().get("rates", []):
+            fixings[item["effectiveDate"]] = item["mid"]
+    return fixings
+
+
+def settled_date() -> str:
+    # Last date whose fixing status can no longer change.
+    now = datetime.now(ZoneInfo("Europe/Warsaw"))
+    day = now.date() if now.hour >= FIXING_SETTLED_HOUR else now.date() - timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+
+def shift(date_str: str, days: int) -> str:
+    return schema.from_day(schema.to_day(date_str) + days)
+
+
+def last_fixing_date(date_str: str) -> str:
+    return plcalendar.last_fixing_date(date.fromisoformat(date_str)).isoformat()
+
+
+def fixing_span(start_str: str, end_str: str):
+    # Narrow [start, end] to its first and last banking day; None if it has none.
+    days = plcalendar.fixing_days_between(date.fromisoformat(start_str), date.fromisoformat(end_str))
+    if not days:
+        return None
+    return days[0].isoformat(), days[-1].isoformat()
+
+
+def sync_usdpln(conn: sqlite3.Connection, start_str: str, end_str: str, verbose: bool = False) -> int:
+    # Make the stored fixings cover [start, end], fetching only the part outside the
+    # recorded coverage. Returns the number of fixings stored.
+    row = conn.execute("SELECT first_day, last_day FROM fx_coverage WHERE pair = ?", (USDPLN,)).fetchone()
+    if row:
+        first, last = (schema.from_day(d) for d in row)
+        spans = {}
+        if start_str < first:
+            spans["before"] = (start_str, shift(first, -1))
+        if end_str > last:
+            spans["after"] = (shift(last, 1), end_str)
+    else:
+        first, last = None, None
+        spans = {"after": (start_str, end_str)}
+    if not spans:
+        return 0
+    # Everything is fetched before the first write, so the store's write lock
+    # is never held across a request while other stages write too.
+    fixings = {}
+    failed = set()
+    for side, span in spans.items():
+        # Spans made only of weekends and holidays cost no request at all.
+        span = fixing_span(*span)
+        if span is None:
+            continue
+        fetched = fetch_usdpln_range(span[0], span[1], verbose)
+        if fetched is None:
+            failed.add(side)
+        else:
+            fixings.update(fetched)
+    conn.executemany(
+        "INSERT OR REPLACE INTO quotes (day, pair, value, source) VALUES (?, ?, ?, ?)",
+        ((schema.to_day(d), USDPLN, rate, SOURCE) for d, rate in fixings.items()),
+    )
+    # A span that failed leaves coverage where it was, so the next run asks
+    # for it again. Coverage never runs past the settled date either, so a
+    # fixing that is not out yet gets asked for again on the next run.
+    new_first = start_str if "before" in spans and "before" not in failed else first
+    new_last = last
+    if "after" in spans and "after" not in failed:
+        new_first = new_first or start_str
+        new_last = min(end_str, settled_date())
+        if last and last > new_last:
+            new_last = last
+    if new_first and new_last and new_last >= new_first:
+        conn.execute(
+            "INSERT OR REPLACE INTO fx_coverage (pair, first_day, last_day) VALUES (?, ?, ?)",
+            (USDPLN, schema.to_day(new_first), schema.to_day(new_last)),
+        )
+    quota.flush(conn)
+    conn.commit()
+    return len(fixings)
+
+
+def load_fixings(conn: sqlite3.Connection, pair: str = USDPLN):
+    rows = conn.execute("SELECT day, value FROM quotes WHERE pair = ? AND source = ? ORDER BY day", (pair, SOURCE)).fetchall()
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+def asof(fix_days, fix_rates, day: int, lookback: int = FIXING_LOOKBACK_DAYS):
+    # Last fixing on or before day, if it is at most `lookback` days old.
+    i = bisect.bisect_right(fix_days, day) - 1
+    if i < 0 or fix_days[i] < day - lookback:
+        return None
+    return fix_rates[i]
+
+
+def fixing_for(fix_days, fix_rates, day: int):
+    # The fixing in force on day: the calendar names the banking day it comes
+    # from; fall back to an as-of lookup if NBP skipped that day.
+    target = schema.to_day(plcalendar.last_fixing_date(schema.day_date(day)))
+    i = bisect.bisect_left(fix_days, target)
+    if i < len(fix_days) and fix_days[i] == target:
+        return fix_rates[i]
+    return asof(fix_days, fix_rates, day)
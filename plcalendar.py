@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import bisect
+from datetime import date, timedelta
+
+# NBP publishes table A on Polish banking days: Monday-Friday except statutory
+# holidays. Fixing days are precomputed per year and looked up with bisect.
+
+
+def easter_sunday(year: int) -> date:
+    # Anonymous Gregorian algorithm (Meeus/Jones/Butcher).
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def holidays(year: int):
+    easter = easter_sunday(year)
+    days = {
+        date(year, 1, 1),  # Nowy Rok
+        date(year, 5, 1),  # Święto Pracy
+        date(year, 5, 3),  # Święto Konstytucji 3 Maja
+        date(year, 8, 15),  # Wniebowzięcie NMP
+        date(year, 11, 1),  # Wszystkich Świętych
+        date(year, 11, 11),  # Święto Niepodległości
+        date(year, 12, 25),  # Boże Narodzenie
+        date(year, 12, 26),  # drugi dzień Bożego Narodzenia
+        easter,
+        easter + timedelta(days=1),  # Poniedziałek Wielkanocny
+        easter + timedelta(days=49),  # Zielone Świątki
+        easter + timedelta(days=60),  # Boże Ciało
+    }
+    if year >= 2011:
+        days.add(date(year, 1, 6))  # Trzech Króli
+    if year >= 2025:
+        days.add(date(year, 12, 24))  # Wigilia
+    return days
+
+
+_fixing_days = {}
+
+
+def fixing_days(year: int):
+    # Sorted banking days of the year, computed once per year.
+    days = _fixing_days.get(year)
+    if days is None:
+        off = holidays(year)
+        cur = date(year, 1, 1)
+        days = []
+        while cur.year == year:
+            if cur.weekday() < 5 and cur not in off:
+                days.append(cur)
+            cur += timedelta(days=1)
+        _fixing_days[year] = days
+    return days
+
+
+def is_fixing_day(d: date) -> bool:
+    days = fixing_days(d.year)
+    i = bisect.bisect_left(days, d)
+    return i < len(days) and days[i] == d
+
+
+def last_fixing_date(d: date) -> date:
+    # Latest banking day on or before d.
+    year = d.year
+    while True:
+        days = fixing_days(year)
+        i = bisect.bisect_right(days, d) - 1
+        if i >= 0:
+            return days[i]
+        year -= 1
+
+
+def fixing_days_between(start: date, end: date):
+    out = []
+    for year in range(start.year, end.year + 1):
+        days = fixing_days(year)
+        out.extend(days[bisect.bisect_left(days, start):bisect.bisect_right(days, end)])
+    return out
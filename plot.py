@@ -1,191 +1,133 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import os
 import sqlite3
 import sys
-import urllib.error
-import urllib.request
-from datetime import datetime, timedelta
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 from matplotlib import font_manager
 from matplotlib.patches import Rectangle
 
-NBP_USDPLN_URL = "https://api.nbp.pl/api/exchangerates/rates/a/usd/{date}/?format=json"
-
-
-def fetch_usdpln(date_str: str, cache: dict):
-    if date_str in cache:
-        return cache[date_str]
-    url = NBP_USDPLN_URL.format(date=date_str)
-    req = urllib.request.Request(
-        url,
-        headers={
-            "Accept": "application/json",
-            "User-Agent": "GypStats/1.0",
-        },
-    )
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-        rate = data["rates"][0]["mid"]
-        cache[date_str] = rate
-        return rate
-    except urllib.error.HTTPError:
-        cache[date_str] = None
-        return None
-
-
-def load_series(db_path: str, column: str):
-    conn = sqlite3.connect(db_path)
-    try:
-        cur = conn.execute(
-            """
-            SELECT date, {col}
-            FROM metal_prices
-            WHERE {col} IS NOT NULL
-            ORDER BY date ASC
-            """.format(col=column)
-        )
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-    if not rows:
-        return [], []
-    dates, values = zip(*rows)
-    return list(dates), list(values)
-
-
-def load_joined_series(gold_db: str, silver_db: str):
-    # Join by date where both series exist.
-    conn = sqlite3.connect(":memory:")
-    try:
-        conn.execute("ATTACH DATABASE ? AS gold", (gold_db,))
-        conn.execute("ATTACH DATABASE ? AS silver", (silver_db,))
-        cur = conn.execute(
-            """
-            SELECT g.date, g.xauusd, s.xagusd
-            FROM gold.metal_prices g
-            JOIN silver.metal_prices s ON s.date = g.date
-            WHERE g.xauusd IS NOT NULL AND s.xagusd IS NOT NULL
-            ORDER BY g.date ASC
-            """
-        )
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-    if not rows:
-        return [], [], []
-    dates, xauusd, xagusd = zip(*rows)
-    return list(dates), list(xauusd), list(xagusd)
-
-
-def ensure_gsp_table(conn: sqlite3.Connection):
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS gsp (
-            date TEXT PRIMARY KEY,
-            xauusd REAL NOT NULL,
-            xagusd REAL NOT NULL,
-            gsr REAL NOT NULL,
-            usdpln REAL,
-            xaupln REAL,
-            xagpln REAL
-        )
-        """
+import httpclient
+import metalprice
+import nbp
+import schema
+import store
+
+# Days before the high-water mark that are still recomputed, so late provider
+# revisions of recent quotes reach the derived series.
+GSP_RECHECK_DAYS = 7
+# Metals also priced in PLN; another one only needs its <metal>USD quotes.
+GSP_METALS = ("XAU", "XAG")
+
+
+def load_series(conn: sqlite3.Connection, pair: str):
+    days, (values,) = store.pivot(conn, [(pair, metalprice.SOURCE)])
+    return days, values
+
+
+def get_meta(conn: sqlite3.Connection, key: str):
+    row = conn.execute("SELECT value FROM gsp_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: str):
+    conn.execute("INSERT OR REPLACE INTO gsp_meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def write_gsp(conn: sqlite3.Connection, rebuild: bool = False, verbose: bool = False):
+    # Derives USDPLN (the fixing that applies to each day), <metal>PLN and the
+    # gold/silver ratio XAUXAG from the metal quotes, as DERIVED_SOURCE quotes.
+    if rebuild:
+        conn.execute("DELETE FROM quotes WHERE source = ?", (store.DERIVED_SOURCE,))
+        conn.execute("DELETE FROM gsp_meta")
+    # Days up to the high-water mark are complete and left alone; only the
+    # tail after it (plus a short window for provider revisions) is recomputed.
+    hwm = get_meta(conn, store.GSP_HWM_KEY)
+    hwm = int(hwm) if hwm is not None else None
+    start = hwm + 1 - GSP_RECHECK_DAYS if hwm is not None else None
+    usd_pairs = [(f"{m}USD", metalprice.SOURCE) for m in GSP_METALS]
+    days, usd = store.pivot(conn, usd_pairs, start=start, optional=usd_pairs)
+    existing = {}
+    for pair in [nbp.USDPLN, "XAUXAG"] + [f"{m}PLN" for m in GSP_METALS]:
+        for d, value in store.read_pair(conn, pair, store.DERIVED_SOURCE, start):
+            existing[(d, pair)] = value
+
+    # Make the stored NBP fixings cover every day still without one, back to
+    # the banking day whose fixing the first one uses, then resolve each day
+    # locally against the Polish banking calendar.
+    need = [d for d in days if (d, nbp.USDPLN) not in existing]
+    if need:
+        nbp.sync_usdpln(conn, nbp.last_fixing_date(schema.from_day(need[0])), schema.from_day(need[-1]))
+    fix_dates, fix_rates = nbp.load_fixings(conn)
+
+    changed = []
+    new_hwm = start - 1 if hwm is not None else None
+    complete = True
+    for d, prices in zip(days, zip(*usd)):
+        prices = dict(zip(GSP_METALS, prices))
+        usdpln = existing.get((d, nbp.USDPLN))
+        if usdpln is None:
+            usdpln = nbp.fixing_for(fix_dates, fix_rates, d)
+        values = {}
+        if usdpln is not None:
+            values[nbp.USDPLN] = usdpln
+            for metal, price in prices.items():
+                if price is not None:
+                    values[f"{metal}PLN"] = price * usdpln
+        if prices.get("XAU") is not None and prices.get("XAG"):
+            values["XAUXAG"] = prices["XAU"] / prices["XAG"]
+        for pair, value in values.items():
+            if existing.get((d, pair)) != value:
+                changed.append((d, pair, value, store.DERIVED_SOURCE))
+        # Only a day with every metal, the fixing and all of their derived
+        # pairs can move the mark; a gap keeps it (and later days) open.
+        complete = complete and usdpln is not None and "XAUXAG" in values and None not in prices.values()
+        if complete:
+            new_hwm = d
+    conn.executemany("INSERT OR REPLACE INTO quotes (day, pair, value, source) VALUES (?, ?, ?, ?)", changed)
+    if new_hwm is not None and new_hwm != hwm:
+        set_meta(conn, store.GSP_HWM_KEY, str(new_hwm))
+    conn.commit()
+    if verbose:
+        through = schema.from_day(new_hwm) if new_hwm is not None else "-"
+        print(f"GSPLN: {len(changed)} quote(s) written, complete through {through}", file=sys.stderr)
+
+
+def load(conn: sqlite3.Connection, rebuild: bool = False, verbose: bool = False) -> dict:
+    # Everything is read (and the gsp series brought up to date) on one
+    # connection before plotting starts.
+    gold = load_series(conn, "XAUUSD")
+    silver = load_series(conn, "XAGUSD")
+    write_gsp(conn, rebuild=rebuild, verbose=verbose)
+    pln = [("XAUPLN", store.DERIVED_SOURCE), ("XAGPLN", store.DERIVED_SOURCE)]
+    joined_dates, joined = store.pivot(
+        conn,
+        [("XAUUSD", metalprice.SOURCE), ("XAGUSD", metalprice.SOURCE)] + pln,
+        optional=pln,
     )
-    cur = conn.execute("PRAGMA table_info(gsp)")
-    cols = {row[1] for row in cur.fetchall()}
-    for col, coltype in (("usdpln", "REAL"), ("xaupln", "REAL"), ("xagpln", "REAL")):
-        if col not in cols:
-            conn.execute(f"ALTER TABLE gsp ADD COLUMN {col} {coltype}")
+    return {"gold": gold, "silver": silver, "joined": (joined_dates, *joined)}
 
 
-def write_gspln_db(db_path: str, dates, xauusd, xagusd):
-    conn = sqlite3.connect(db_path)
-    try:
-        ensure_gsp_table(conn)
-        cur = conn.execute("SELECT date, usdpln, xaupln, xagpln FROM gsp")
-        existing = {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
-        rows = []
-        usd_cache = {}
-        usdpln_list = []
-        xaupln_list = []
-        xagpln_list = []
-        for d, g, s in zip(dates, xauusd, xagusd):
-            if s:
-                usdpln, xaupln, xagpln = existing.get(d, (None, None, None))
-                if usdpln is None or xaupln is None or xagpln is None:
-                    usdpln = fetch_usdpln(d, usd_cache)
-                    if usdpln is None:
-                        # Try up to 7 days back for last available NBP fixing.
-                        back = datetime.strptime(d, "%Y-%m-%d")
-                        for _ in range(7):
-                            back = back.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
-                            ds = back.strftime("%Y-%m-%d")
-                            usdpln = fetch_usdpln(ds, usd_cache)
-                            if usdpln is not None:
-                                break
-                    if usdpln is not None:
-                        xaupln = float(g) * float(usdpln)
-                        xagpln = float(s) * float(usdpln)
-                    else:
-                        xaupln = None
-                        xagpln = None
-                rows.append((d, float(g), float(s), float(g) / float(s), usdpln, xaupln, xagpln))
-                usdpln_list.append(usdpln)
-                xaupln_list.append(xaupln)
-                xagpln_list.append(xagpln)
-        conn.executemany(
-            "INSERT OR REPLACE INTO gsp (date, xauusd, xagusd, gsr, usdpln, xaupln, xagpln) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            rows,
-        )
-        conn.commit()
-    finally:
-        conn.close()
-    return usdpln_list, xaupln_list, xagpln_list
-
-
-def main():
-    parser = argparse.ArgumentParser(description="Plot XAUUSD/XAGUSD/GSR over time from SQLite")
-    parser.add_argument("--gold-db", default="goldprice.db", help="Path to gold DB (default: goldprice.db)")
-    parser.add_argument("--silver-db", default="silverprice.db", help="Path to silver DB (default: silverprice.db)")
-    parser.add_argument("--out-gold", default="", help="Optional output image for gold (e.g. xauusd.png)")
-    parser.add_argument("--out-silver", default="", help="Optional output image for silver (e.g. xagusd.png)")
-    parser.add_argument("--out-all", default="", help="Optional output image for combined plot (e.g. all.png)")
-    parser.add_argument("--gspln-db", default="GSPLN.db", help="Output DB for joined series (default: GSPLN.db)")
-    parser.add_argument("--show", action="store_true", help="Show interactive window")
-    args = parser.parse_args()
-
-    gold_db = args.gold_db
-    silver_db = args.silver_db
-    if not os.path.isabs(gold_db):
-        gold_db = os.path.join(os.path.dirname(__file__), gold_db)
-    if not os.path.isabs(silver_db):
-        silver_db = os.path.join(os.path.dirname(__file__), silver_db)
-    gspln_db = args.gspln_db
-    if not os.path.isabs(gspln_db):
-        gspln_db = os.path.join(os.path.dirname(__file__), gspln_db)
-    plots_dir = os.path.join(os.path.dirname(__file__), "plots")
-    os.makedirs(plots_dir, exist_ok=True)
-
-    if not os.path.exists(gold_db):
-        print(f"Error: gold DB not found: {gold_db}", file=sys.stderr)
-        sys.exit(2)
-    if not os.path.exists(silver_db):
-        print(f"Error: silver DB not found: {silver_db}", file=sys.stderr)
-        sys.exit(2)
-
-    gold_dates, gold_values = load_series(gold_db, "xauusd")
+def render(series: dict, out_gold: str = "", out_silver: str = "", out_all: str = "", show: bool = False) -> bool:
+    gold_dates, gold_values = series["gold"]
+    silver_dates, silver_values = series["silver"]
+    joined_dates, joined_xauusd, joined_xagusd, xaupln_list, xagpln_list = series["joined"]
     if not gold_dates:
         print("No xauusd data to plot.", file=sys.stderr)
-        sys.exit(1)
-    silver_dates, silver_values = load_series(silver_db, "xagusd")
+        return False
     if not silver_dates:
         print("No xagusd data to plot.", file=sys.stderr)
-        sys.exit(1)
+        return False
+    os.makedirs(os.path.join(os.path.dirname(__file__), "plots"), exist_ok=True)
+
+    def date_axis(ax):
+        # x-values are store day numbers, which matplotlib reads as days since 1970-01-01.
+        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d"))
 
     def plot_one(dates, values, title, ylabel, ax, color=None, linewidth=1.5, linestyle="-", zero_min=False):
         ax.plot(dates, values, linewidth=linewidth, color=color, linestyle=linestyle)
@@ -207,6 +149,7 @@ def main():
                 fontsize=8,
                 color="#9aa3ad",
             )
+        date_axis(ax)
         for label in ax.get_xticklabels():
             label.set_rotation(45)
 
@@ -220,15 +163,15 @@ def main():
         linewidth=2.6,
         zero_min=True,
     )
-    gold_out = args.out_gold
-    if not gold_out and not args.show:
+    gold_out = out_gold
+    if not gold_out and not show:
         gold_out = os.path.join("plots", "xauusd.png")
     if gold_out:
         if not os.path.isabs(gold_out):
             gold_out = os.path.join(os.path.dirname(__file__), gold_out)
         plt.savefig(gold_out, dpi=150)
         print(f"Saved plot to {gold_out}")
-    if args.show:
+    if show:
         plt.show()
 
     plot_one(
@@ -241,20 +184,18 @@ def main():
         linewidth=2.6,
         zero_min=True,
     )
-    silver_out = args.out_silver
-    if not silver_out and not args.show:
+    silver_out = out_silver
+    if not silver_out and not show:
         silver_out = os.path.join("plots", "xagusd.png")
     if silver_out:
         if not os.path.isabs(silver_out):
             silver_out = os.path.join(os.path.dirname(__file__), silver_out)
         plt.savefig(silver_out, dpi=150)
         print(f"Saved plot to {silver_out}")
-    if args.show:
+    if show:
         plt.show()
 
-    joined_dates, joined_xauusd, joined_xagusd = load_joined_series(gold_db, silver_db)
     if joined_dates:
-        usdpln_list, xaupln_list, xagpln_list = write_gspln_db(gspln_db, joined_dates, joined_xauusd, joined_xagusd)
         gsr_values = [g / s for g, s in zip(joined_xauusd, joined_xagusd)]
 
         fig, axes = plt.subplots(7, 1, figsize=(10, 18), sharex=True)
@@ -394,19 +335,20 @@ def main():
         axes[6].set_title("Trends overlay (normalized)")
         axes[6].set_ylabel("Index")
         axes[6].legend(loc="upper left")
+        date_axis(axes[6])
         for label in axes[6].get_xticklabels():
             label.set_rotation(45)
         fig.tight_layout(rect=(0, 0, 1, 0.865))
 
-        all_out = args.out_all
-        if not all_out and not args.show:
+        all_out = out_all
+        if not all_out and not show:
             all_out = os.path.join("plots", "all.png")
         if all_out:
             if not os.path.isabs(all_out):
                 all_out = os.path.join(os.path.dirname(__file__), all_out)
             fig.savefig(all_out, dpi=150)
             print(f"Saved plot to {all_out}")
-        if args.show:
+        if show:
             plt.show()
 
         # PLN-based plots (filter out missing PLN rates)
@@ -498,6 +440,7 @@ def main():
             axes_pln[3].set_title("Trends overlay (normalized)")
             axes_pln[3].set_ylabel("Index")
             axes_pln[3].legend(loc="upper left")
+            date_axis(axes_pln[3])
             for label in axes_pln[3].get_xticklabels():
                 label.set_rotation(45)
             fig_pln.tight_layout(rect=(0, 0, 1, 0.865))
@@ -507,13 +450,44 @@ def main():
                 allpl_out = os.path.join(os.path.dirname(__file__), allpl_out)
             fig_pln.savefig(allpl_out, dpi=150)
             print(f"Saved plot to {allpl_out}")
-            if args.show:
+            if show:
                 plt.show()
         else:
             print("No PLN data available to plot allpl.png.", file=sys.stderr)
     else:
         print("No joined xauusd/xagusd data to compute GSR.", file=sys.stderr)
 
+    # Figures are released so repeated renders in one process don't pile up.
+    plt.close("all")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot XAUUSD/XAGUSD/GSR over time from SQLite")
+    parser.add_argument("--db", default=store.STORE_FILENAME, help=f"Path to the store (default: {store.STORE_FILENAME})")
+    parser.add_argument("--out-gold", default="", help="Optional output image for gold (e.g. xauusd.png)")
+    parser.add_argument("--out-silver", default="", help="Optional output image for silver (e.g. xagusd.png)")
+    parser.add_argument("--out-all", default="", help="Optional output image for combined plot (e.g. all.png)")
+    parser.add_argument("--show", action="store_true", help="Show interactive window")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every gsp row instead of only new/changed ones")
+    args = parser.parse_args()
+
+    db_path = args.db
+    if not os.path.isabs(db_path):
+        db_path = os.path.join(os.path.dirname(__file__), db_path)
+    if not os.path.exists(db_path):
+        print(f"Error: store not found: {db_path}", file=sys.stderr)
+        sys.exit(2)
+
+    conn = store.connect(db_path)
+    try:
+        series = load(conn, rebuild=args.rebuild, verbose=True)
+    finally:
+        conn.close()
+    if series["joined"][0]:
+        print(httpclient.get_client().summary(), file=sys.stderr)
+    if not render(series, args.out_gold, args.out_silver, args.out_all, args.show):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
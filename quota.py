@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import sqlite3
+import threading
+from datetime import datetime
+
+import schema
+
+# Requests sent but not yet written to quota_ledger: {(provider, day): count}.
+_pending = {}
+_lock = threading.Lock()
+
+
+def today() -> int:
+    # Provider quotas reset on UTC days and months.
+    return schema.to_day(datetime.utcnow().date())
+
+
+def month_start(day: int) -> int:
+    return schema.to_day(schema.day_date(day).replace(day=1))
+
+
+def spend(provider: str, n: int = 1):
+    # Called by the fetch layer for every request it sends, retries included.
+    key = (provider, today())
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + n
+
+
+def flush(conn: sqlite3.Connection):
+    # Adds the pending counts to quota_ledger; the caller commits, so they land
+    # in the same transaction as the data the requests brought in.
+    with _lock:
+        rows = [(provider, day, n) for (provider, day), n in _pending.items()]
+        _pending.clear()
+    conn.executemany(
+        """
+        INSERT INTO quota_ledger (provider, day, requests) VALUES (?, ?, ?)
+        ON CONFLICT (provider, day) DO UPDATE SET requests = requests + excluded.requests
+        """,
+        rows,
+    )
+
+
+def usage(conn: sqlite3.Connection, provider: str, day: int = None):
+    # (requests on day, requests in day's month up to day), unflushed ones included.
+    day = today() if day is None else day
+    first = month_start(day)
+    on_day, in_month = conn.execute(
+        """
+        SELECT COALESCE(SUM(CASE WHEN day = ? THEN requests END), 0), COALESCE(SUM(requests), 0)
+        FROM quota_ledger WHERE provider = ? AND day BETWEEN ? AND ?
+        """,
+        (day, provider, first, day),
+    ).fetchone()
+    with _lock:
+        for (p, d), n in _pending.items():
+            if p == provider and first <= d <= day:
+                in_month += n
+                if d == day:
+                    on_day += n
+    return on_day, in_month
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+import hashlib
+import sqlite3
+import sys
+import zlib
+from datetime import date
+
+# Each DB file carries its schema version in PRAGMA user_version. Migrations are
+# ordered (description, step) pairs; step N brings a DB from version N-1 to N and
+# runs exactly once. Steps must tolerate legacy files created before versioning
+# (user_version 0 with tables already present). Steps listed in SHRINKING free
+# a lot of pages, so the file is vacuumed once after they run.
+
+PAYLOADS_FILENAME = "payloads.db"
+# Raw provider payloads live in a separate file attached under this name, so
+# identical responses stored for several metals are kept once.
+PAYLOADS_SCHEMA = "payloads"
+# Payloads are ~100 bytes, too small for plain zlib to gain anything, so they are
+# deflated against a preset dictionary of the provider's boilerplate. The first
+# byte of every stored body names the dictionary; never edit a published one.
+PAYLOAD_DICTS = {
+    1: (
+        b'{"success":true,"base":"USD","timestamp":17,"date":"2026-","rates":{'
+        b'"USDXAU":,"XAU":0.000,"USDXAG":,"XAG":0.0,"USDXPT":,"XPT":0.00,"USDXPD":,"XPD":0.00'
+    ),
+}
+PAYLOAD_DICT_VERSION = 1
+# Store keys are days since 1970-01-01 (which is also matplotlib's date number).
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_day(value) -> int:
+    # "YYYY-MM-DD" or a date -> day number.
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def day_date(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def from_day(day: int) -> str:
+    return day_date(day).isoformat()
+
+
+def iso_to_day_sql(expr: str) -> str:
+    return f"CAST(julianday({expr}) - 2440587.5 AS INTEGER)"
+
+
+def day_to_iso_sql(expr: str) -> str:
+    return f"date({expr} * 86400, 'unixepoch')"
+
+
+def user_version(conn: sqlite3.Connection, schema_name: str = "main") -> int:
+    return conn.execute(f"PRAGMA {schema_name}.user_version").fetchone()[0]
+
+
+def column_names(conn: sqlite3.Connection, table: str):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def migrate(conn: sqlite3.Connection, migrations, verbose: bool = False, schema_name: str = "main", **ctx) -> int:
+    version = user_version(conn, schema_name)
+    if version >= len(migrations):
+        return version
+    shrunk = False
+    for target in range(version + 1, len(migrations) + 1):
+        description, step = migrations[target - 1]
+        conn.execute("BEGIN")
+        try:
+            step(conn, **ctx)
+            conn.execute(f"PRAGMA {schema_name}.user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        shrunk = shrunk or step in SHRINKING
+        if verbose:
+            print(f"Schema v{target}: {description}", file=sys.stderr)
+    if shrunk:
+        conn.execute(f"VACUUM {schema_name}")
+    return len(migrations)
+
+
+def payload_hash(raw: str) -> bytes:
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+
+def pack_payload(raw: str) -> bytes:
+    comp = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=PAYLOAD_DICTS[PAYLOAD_DICT_VERSION])
+    return bytes([PAYLOAD_DICT_VERSION]) + comp.compress(raw.encode("utf-8")) + comp.flush()
+
+
+def unpack_payload(blob: bytes) -> str:
+    decomp = zlib.decompressobj(-15, zdict=PAYLOAD_DICTS[blob[0]])
+    return (decomp.decompress(blob[1:]) + decomp.flush()).decode("utf-8")
+
+
+def attach_payloads(conn: sqlite3.Connection, path: str, verbose: bool = False):
+    conn.execute(f"ATTACH DATABASE ? AS {PAYLOADS_SCHEMA}", (path,))
+    migrate(conn, PAYLOAD_MIGRATIONS, verbose, schema_name=PAYLOADS_SCHEMA)
+
+
+# raw_payloads (payloads.db, attached as "payloads").
+
+def _payloads_create(conn: sqlite3.Connection):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PAYLOADS_SCHEMA}.raw_payloads (
+            hash BLOB PRIMARY KEY,
+            body BLOB NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+PAYLOAD_MIGRATIONS = [
+    ("create raw_payloads", _payloads_create),
+]
+
+
+# metal_prices (goldprice.db, silverprice.db, ...). ctx: metal="XAU".
+
+def _metal_create(conn: sqlite3.Connection, metal: str):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS metal_prices (
+            date TEXT NOT NULL,
+            base TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            rate REAL NOT NULL,
+            {metal.lower()}usd REAL,
+            source TEXT NOT NULL,
+            raw_json TEXT NOT NULL,
+            PRIMARY KEY (date, base, symbol, source)
+        )
+        """
+    )
+
+
+def _metal_add_usd_column(conn: sqlite3.Connection, metal: str):
+    # Early goldprice.db files predate the USD column.
+    col = f"{metal.lower()}usd"
+    if col not in column_names(conn, "metal_prices"):
+        conn.execute(f"ALTER TABLE metal_prices ADD COLUMN {col} REAL")
+
+
+def _metal_backfill_usd(conn: sqlite3.Connection, metal: str):
+    # Derive <metal>usd from rate for rows written before the column existed.
+    col = f"{metal.lower()}usd"
+    conn.execute(
+        f"""
+        UPDATE metal_prices
+        SET {col} = CASE
+            WHEN base = 'USD' AND symbol = ? AND rate IS NOT NULL THEN (1.0 / rate)
+            WHEN base = ? AND symbol = 'USD' AND rate IS NOT NULL THEN rate
+            ELSE {col}
+        END
+        WHERE {col} IS NULL
+          AND ((base = 'USD' AND symbol = ?) OR (base = ? AND symbol = 'USD'))
+        """,
+        (metal, metal, metal, metal),
+    )
+
+
+def _metal_archive_raw(conn: sqlite3.Connection, metal: str):
+    # Move raw_json into the attached content-addressed archive and keep only
+    # its hash in metal_prices. Needs payloads.db attached (attach_payloads).
+    conn.execute("ALTER TABLE metal_prices ADD COLUMN raw_hash BLOB")
+    rows = conn.execute("SELECT rowid, raw_json FROM metal_prices").fetchall()
+    packed = {}
+    updates = []
+    for rowid, raw in rows:
+        h = payload_hash(raw)
+        if h not in packed:
+            packed[h] = pack_payload(raw)
+        updates.append((h, rowid))
+    conn.executemany(f"INSERT OR IGNORE INTO {PAYLOADS_SCHEMA}.raw_payloads (hash, body) VALUES (?, ?)", packed.items())
+    conn.executemany("UPDATE metal_prices SET raw_hash = ? WHERE rowid = ?", updates)
+    conn.execute("ALTER TABLE metal_prices DROP COLUMN raw_json")
+
+
+def _metal_create_failures(conn: sqlite3.Connection, metal: str):
+    # Negative cache: requests the provider could not serve, with an expiry
+    # (NULL = permanent) so reruns skip them without an HTTP call.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fetch_failures (
+            date TEXT NOT NULL,
+            base TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            source TEXT NOT NULL,
+            error_class TEXT NOT NULL,
+            code TEXT,
+            info TEXT,
+            failed_at INTEGER NOT NULL,
+            expires_at INTEGER,
+            PRIMARY KEY (date, base, symbol, source)
+        )
+        """
+    )
+
+
+METAL_MIGRATIONS = [
+    ("create metal_prices", _metal_create),
+    ("add <metal>usd column", _metal_add_usd_column),
+    ("backfill <metal>usd from rate", _metal_backfill_usd),
+    ("move raw_json into the shared payload archive", _metal_archive_raw),
+    ("create fetch_failures negative cache", _metal_create_failures),
+]
+
+
+# gsp (GSPLN.db).
+
+def _gsp_create(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS gsp (
+            date TEXT PRIMARY KEY,
+            xauusd REAL NOT NULL,
+            xagusd REAL NOT NULL,
+            gsr REAL NOT NULL,
+            usdpln REAL,
+            xaupln REAL,
+            xagpln REAL
+        )
+        """
+    )
+
+
+def _gsp_add_pln_columns(conn: sqlite3.Connection):
+    cols = column_names(conn, "gsp")
+    for col in ("usdpln", "xaupln", "xagpln"):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE gsp ADD COLUMN {col} REAL")
+
+
+def _gsp_create_fx_rates(conn: sqlite3.Connection):
+    # FX fixings kept across runs; fx_coverage records the contiguous span that
+    # has been fetched, so days without a fixing are not asked for again.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            date TEXT NOT NULL,
+            pair TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (pair, date)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fx_coverage (
+            pair TEXT PRIMARY KEY,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _gsp_create_meta(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS gsp_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+
+
+GSP_MIGRATIONS = [
+    ("create gsp", _gsp_create),
+    ("add PLN columns to gsp", _gsp_add_pln_columns),
+    ("create fx_rates and fx_coverage", _gsp_create_fx_rates),
+    ("create gsp_meta", _gsp_create_meta),
+]
+
+
+# Consolidated store (gypstats.db): every metal, FX rates and the derived gsp
+# series in one file. The payload archive stays in payloads.db, attached.
+
+def _store_create(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metal_prices (
+            date TEXT NOT NULL,
+            base TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            rate REAL NOT NULL,
+            usd REAL,
+            source TEXT NOT NULL,
+            raw_hash BLOB,
+            PRIMARY KEY (date, base, symbol, source)
+        )
+        """
+    )
+    # Covers the per-series date-range reads (cache lookups, plots, gsp build)
+    # without touching the table rows.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS metal_prices_series
+        ON metal_prices (symbol, base, source, date, rate, usd)
+        """
+    )
+    _metal_create_failures(conn, metal=None)
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS fetch_failures_series
+        ON fetch_failures (symbol, base, source, date, expires_at)
+        """
+    )
+    _gsp_create(conn)
+    _gsp_create_fx_rates(conn)
+    _gsp_create_meta(conn)
+
+
+def quotes_from_metal_prices(conn: sqlite3.Connection, src: str = "main", day_sql: str = "date") -> int:
+    # One quote per stored price, the non-base side priced in the base (or the
+    # metal in USD when USD was the requested symbol), e.g. XAUUSD. day_sql
+    # turns the source's date column into the target's day value.
+    cur = conn.execute(
+        f"""
+        INSERT OR IGNORE INTO quotes (day, pair, value, source)
+        SELECT {day_sql},
+               CASE WHEN symbol = 'USD' THEN base || 'USD' ELSE symbol || base END,
+               CASE WHEN symbol = 'USD' THEN rate ELSE 1.0 / rate END,
+               source
+        FROM {src}.metal_prices
+        WHERE rate IS NOT NULL AND rate != 0
+        """
+    )
+    return cur.rowcount
+
+
+def quotes_from_gsp(conn: sqlite3.Connection, src: str = "main", day_sql: str = "date") -> int:
+    # NBP fixings and the derived gsp columns, as long-format quotes.
+    rows = conn.execute(f"INSERT OR IGNORE INTO quotes (day, pair, value, source) SELECT {day_sql}, pair, rate, 'nbp' FROM {src}.fx_rates").rowcount
+    for pair, col in (("USDPLN", "usdpln"), ("XAUPLN", "xaupln"), ("XAGPLN", "xagpln"), ("XAUXAG", "gsr")):
+        cur = conn.execute(
+            f"INSERT OR IGNORE INTO quotes (day, pair, value, source) SELECT {day_sql}, ?, {col}, 'gsp' FROM {src}.gsp WHERE {col} IS NOT NULL",
+            (pair,),
+        )
+        rows += cur.rowcount
+    return rows
+
+
+def _store_create_quotes(conn: sqlite3.Connection):
+    # Every series (metal prices, FX fixings, derived PLN prices and the
+    # gold/silver ratio) as (day, pair, value, source) rows, so a new metal or
+    # currency is new rows rather than new columns. The clustered primary key
+    # doubles as the (pair, day) index behind every series read.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quotes (
+            day TEXT NOT NULL,
+            pair TEXT NOT NULL,
+            value REAL NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (pair, day, source)
+        ) WITHOUT ROWID
+        """
+    )
+    quotes_from_metal_prices(conn)
+    quotes_from_gsp(conn)
+    # metal_prices keeps what was requested (rate, payload); the USD value now
+    # lives in quotes only.
+    conn.execute("DROP INDEX IF EXISTS metal_prices_series")
+    conn.execute("ALTER TABLE metal_prices DROP COLUMN usd")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS metal_prices_series
+        ON metal_prices (symbol, base, source, date, rate)
+        """
+    )
+    conn.execute("DROP TABLE gsp")
+    conn.execute("DROP TABLE fx_rates")
+
+
+def _store_integer_days(conn: sqlite3.Connection):
+    # Day numbers (schema.to_day) replace the TEXT dates in every key; the
+    # *_iso views show the tables with their old TEXT date columns.
+    iso = iso_to_day_sql
+    conn.execute(
+        """
+        CREATE TABLE metal_prices_new (
+            day INTEGER NOT NULL,
+            base TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            rate REAL NOT NULL,
+            source TEXT NOT NULL,
+            raw_hash BLOB,
+            PRIMARY KEY (day, base, symbol, source)
+        )
+        """
+    )
+    conn.execute(f"INSERT INTO metal_prices_new SELECT {iso('date')}, base, symbol, rate, source, raw_hash FROM metal_prices ORDER BY date")
+    conn.execute(
+        """
+        CREATE TABLE fetch_failures_new (
+            day INTEGER NOT NULL,
+            base TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            source TEXT NOT NULL,
+            error_class TEXT NOT NULL,
+            code TEXT,
+            info TEXT,
+            failed_at INTEGER NOT NULL,
+            expires_at INTEGER,
+            PRIMARY KEY (day, base, symbol, source)
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO fetch_failures_new
+        SELECT {iso('date')}, base, symbol, source, error_class, code, info, failed_at, expires_at FROM fetch_failures
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE quotes_new (
+            day INTEGER NOT NULL,
+            pair TEXT NOT NULL,
+            value REAL NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (pair, day, source)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(f"INSERT INTO quotes_new SELECT {iso('day')}, pair, value, source FROM quotes")
+    conn.execute(
+        """
+        CREATE TABLE fx_coverage_new (
+            pair TEXT PRIMARY KEY,
+            first_day INTEGER NOT NULL,
+            last_day INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(f"INSERT INTO fx_coverage_new SELECT pair, {iso('first_date')}, {iso('last_date')} FROM fx_coverage")
+    for table in ("metal_prices", "fetch_failures", "quotes", "fx_coverage"):
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    conn.execute("CREATE INDEX metal_prices_series ON metal_prices (symbol, base, source, day, rate)")
+    conn.execute("CREATE INDEX fetch_failures_series ON fetch_failures (symbol, base, source, day, expires_at)")
+    conn.execute(f"UPDATE gsp_meta SET value = {iso('value')} WHERE key = 'complete_through'")
+
+    text = day_to_iso_sql
+    conn.execute(f"CREATE VIEW metal_prices_iso AS SELECT {text('day')} AS date, base, symbol, rate, source, raw_hash FROM metal_prices")
+    conn.execute(
+        f"""
+        CREATE VIEW fetch_failures_iso AS
+        SELECT {text('day')} AS date, base, symbol, source, error_class, code, info, failed_at, expires_at FROM fetch_failures
+        """
+    )
+    conn.execute(f"CREATE VIEW quotes_iso AS SELECT {text('day')} AS date, pair, value, source FROM quotes")
+    conn.execute(
+        f"""
+        CREATE VIEW fx_coverage_iso AS
+        SELECT pair, {text('first_day')} AS first_date, {text('last_day')} AS last_date FROM fx_coverage
+        """
+    )
+
+
+def _store_create_backfill(conn: sqlite3.Connection):
+    # One row per backfill job: next_day is the first day not yet committed,
+    # quota_spent counts the job's requests on quota_day (a UTC day number).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            job TEXT PRIMARY KEY,
+            base TEXT NOT NULL,
+            symbols TEXT NOT NULL,
+            start_day INTEGER NOT NULL,
+            end_day INTEGER NOT NULL,
+            next_day INTEGER NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            quota_day INTEGER,
+            quota_spent INTEGER NOT NULL DEFAULT 0,
+            started_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _store_create_quota_ledger(conn: sqlite3.Connection):
+    # Requests sent per provider and UTC day number; months are summed from days.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quota_ledger (
+            provider TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            PRIMARY KEY (provider, day)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _store_add_fetched_at(conn: sqlite3.Connection):
+    # When each price was fetched (unix seconds); NULL for rows that predate it.
+    conn.execute("ALTER TABLE metal_prices ADD COLUMN fetched_at INTEGER")
+    conn.execute("DROP INDEX metal_prices_series")
+    conn.execute("CREATE INDEX metal_prices_series ON metal_prices (symbol, base, source, day, rate, fetched_at)")
+    conn.execute("DROP VIEW metal_prices_iso")
+    conn.execute(f"CREATE VIEW metal_prices_iso AS SELECT {day_to_iso_sql('day')} AS date, base, symbol, rate, source, raw_hash, fetched_at FROM metal_prices")
+
+
+def _store_create_snapshots(conn: sqlite3.Connection):
+    # Intraday quotes from /latest, keyed by the provider's timestamp floored
+    # to a bucket (unix seconds).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metal_snapshots (
+            symbol TEXT NOT NULL,
+            base TEXT NOT NULL,
+            source TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            fetched_at INTEGER NOT NULL,
+            raw_hash BLOB,
+            PRIMARY KEY (symbol, base, source, bucket)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _store_expire_unknown_failures(conn: sqlite3.Connection):
+    # Errors other than the provider's "no results" (106) used to be cached as
+    # permanent no_data; give them the one-day "unknown" lifetime instead.
+    conn.execute(
+        """
+        UPDATE fetch_failures SET error_class = 'unknown', expires_at = failed_at + 86400
+        WHERE error_class = 'no_data' AND (code IS NULL OR code <> '106')
+        """
+    )
+
+
+STORE_MIGRATIONS = [
+    ("create consolidated store", _store_create),
+    ("move series into long-format quotes", _store_create_quotes),
+    ("key every table by integer day number", _store_integer_days),
+    ("create backfill_checkpoints", _store_create_backfill),
+    ("create quota_ledger", _store_create_quota_ledger),
+    ("add metal_prices.fetched_at", _store_add_fetched_at),
+    ("create metal_snapshots", _store_create_snapshots),
+    ("expire failures cached without a no-data code", _store_expire_unknown_failures),
+]
+
+
+SHRINKING = {_metal_archive_raw, _store_create_quotes, _store_integer_days}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_WORKERS = 4
+
+
+def run_stages(stages, workers: int = DEFAULT_WORKERS, verbose: bool = True) -> dict:
+    # stages is a list of (name, deps, fn). fn(results) starts as soon as every
+    # stage named in deps has finished; results maps finished stage names to
+    # their return values. Independent stages run concurrently. After a failure
+    # no new stage starts; the running ones finish and the first error is re-raised.
+    graph = {}
+    for name, deps, fn in stages:
+        if name in graph:
+            raise ValueError(f"duplicate stage: {name}")
+        graph[name] = (tuple(deps), fn)
+    for name, (deps, _) in graph.items():
+        for dep in deps:
+            if dep not in graph:
+                raise ValueError(f"stage {name} depends on unknown stage {dep}")
+
+    results = {}
+    timings = {}
+    waiting = dict(graph)
+    running = {}
+    failed = None
+    started = time.perf_counter()
+
+    def timed(name, fn):
+        begin = time.perf_counter()
+        try:
+            return fn(results)
+        finally:
+            timings[name] = (begin - started, time.perf_counter() - begin)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                if failed is None:
+                    for name, (deps, fn) in list(waiting.items()):
+                        if all(dep in results for dep in deps):
+                            del waiting[name]
+                            running[pool.submit(timed, name, fn)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException as exc:
+                        print(f"Stage {name} failed: {exc!r}", file=sys.stderr)
+                        if failed is None:
+                            failed = exc
+    finally:
+        if verbose:
+            report(stages, timings, time.perf_counter() - started)
+    if failed is not None:
+        raise failed
+    if waiting:
+        raise ValueError(f"stages never became ready (dependency cycle): {', '.join(sorted(waiting))}")
+    return results
+
+
+def report(stages, timings: dict, total: float):
+    # Start offset and duration per stage, so overlapping stages are visible.
+    width = max(len(name) for name, _, _ in stages)
+    print(f"Stage timings (wall {total:.2f}s):", file=sys.stderr)
+    for name, _, _ in stages:
+        if name in timings:
+            offset, elapsed = timings[name]
+            print(f"  {name:<{width}}  +{offset:6.2f}s  {elapsed:6.2f}s", file=sys.stderr)
+        else:
+            print(f"  {name:<{width}}  skipped", file=sys.stderr)
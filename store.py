@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sqlite3
+import sys
+
+import nbp
+import schema
+
+# Consolidated store: metal prices, fetch failures and every series (metal
+# quotes, FX fixings, derived gsp values) as long-format quotes, in one
+# WAL-mode file (schema.STORE_MIGRATIONS).
+STORE_FILENAME = "gypstats.db"
+# Per-file DBs from before the store. They are still exported after every
+# update because index.html links them for download.
+LEGACY_METAL_DBS = {
+    "XAU": "goldprice.db",
+    "XAG": "silverprice.db",
+}
+LEGACY_GSP_DB = "GSPLN.db"
+# quotes.source of the series plot.py derives (PLN prices, gold/silver ratio,
+# the USD/PLN fixing applied to each day).
+DERIVED_SOURCE = "gsp"
+# gsp_meta key of the last day whose derived quotes are all written.
+GSP_HWM_KEY = "complete_through"
+# PRAGMA application_id of a store ("GYPS"), so the per-file DBs and other
+# SQLite files are never mistaken for one and migrated in place.
+STORE_APPLICATION_ID = 0x47595053
+# synchronous=NORMAL is safe in WAL mode: a power cut can only lose the last
+# commits, which the next run fetches again.
+PRAGMAS = (
+    ("main.journal_mode", "WAL"),
+    ("main.synchronous", "NORMAL"),
+    ("main.mmap_size", 256 * 1024 * 1024),
+    ("main.cache_size", -32 * 1024),  # in KiB
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", 5000),
+)
+
+
+def payloads_path_for(db_path: str) -> str:
+    return os.path.join(os.path.dirname(db_path), schema.PAYLOADS_FILENAME)
+
+
+def is_store(conn: sqlite3.Connection) -> bool:
+    # Stores created before the application_id marker: a new file, or one with
+    # the tables only a store has together (quotes from v2 on; metal_prices and
+    # gsp in v1, which the legacy files only ever have one of).
+    app_id = conn.execute("PRAGMA application_id").fetchone()[0]
+    if app_id != 0:
+        return app_id == STORE_APPLICATION_ID
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return not tables or "quotes" in tables or {"metal_prices", "gsp"} <= tables
+
+
+def connect(db_path: str, verbose: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    # Checked before the pragmas, which would already switch a foreign file to WAL.
+    if not is_store(conn):
+        conn.close()
+        print(f"Error: {db_path} is not a {STORE_FILENAME} store (a legacy per-metal or GSPLN DB, or another SQLite file).", file=sys.stderr)
+        print("Pass the store's path, or copy the legacy files into it with: store.py import", file=sys.stderr)
+        sys.exit(2)
+    if conn.execute("PRAGMA application_id").fetchone()[0] != STORE_APPLICATION_ID:
+        conn.execute(f"PRAGMA application_id = {STORE_APPLICATION_ID}")
+        conn.commit()
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    schema.attach_payloads(conn, payloads_path_for(db_path), verbose)
+    schema.migrate(conn, schema.STORE_MIGRATIONS, verbose)
+    return conn
+
+
+def checkpoint(conn: sqlite3.Connection):
+    # Fold the WAL into the main file and truncate it, so the .db alone is
+    # complete (e.g. before it is committed).
+    conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+
+
+def lower_gsp_mark(conn: sqlite3.Connection, day: int):
+    # Quotes written for a day at or below the gsp high-water mark move it back
+    # to the day before, so plot.write_gsp derives that day again.
+    conn.execute(
+        "UPDATE gsp_meta SET value = ? WHERE key = ? AND CAST(value AS INTEGER) >= ?",
+        (str(day - 1), GSP_HWM_KEY, day),
+    )
+
+
+def missing_days(conn: sqlite3.Connection, base: str, symbol: str, source: str, start: int, end: int, now: int):
+    # Coverage check: days in [start, end] with neither a stored price nor a
+    # live negative-cache entry, ascending. Both lookups are index-only scans
+    # over metal_prices_series and fetch_failures_series.
+    params = (symbol, base, source, start, end)
+    have = {row[0] for row in conn.execute("SELECT day FROM metal_prices WHERE symbol = ? AND base = ? AND source = ? AND day BETWEEN ? AND ?", params)}
+    cur = conn.execute(
+        """
+        SELECT day FROM fetch_failures
+        WHERE symbol = ? AND base = ? AND source = ? AND day BETWEEN ? AND ?
+          AND (expires_at IS NULL OR expires_at > ?)
+        """,
+        params + (now,),
+    )
+    have.update(row[0] for row in cur)
+    return [d for d in range(start, end + 1) if d not in have]
+
+
+def read_pair(conn: sqlite3.Connection, pair: str, source: str = None, start: int = None, end: int = None):
+    # [(day, value)] in day order, days as schema.to_day numbers (None = no
+    # bound); one range scan over the quotes primary key.
+    sql = "SELECT day, value FROM quotes WHERE pair = ?"
+    params = [pair]
+    if start is not None:
+        sql += " AND day >= ?"
+        params.append(start)
+    if end is not None:
+        sql += " AND day <= ?"
+        params.append(end)
+    if source:
+        sql += " AND source = ?"
+        params.append(source)
+    return conn.execute(sql + " ORDER BY day", params).fetchall()
+
+
+def pivot(conn: sqlite3.Connection, pairs, start: int = None, end: int = None, optional=()):
+    # Aligns several series on day: pairs are "XAUUSD" or ("XAUPLN", source)
+    # entries. Returns (days, [values per entry]); a day is kept when every
+    # entry not in optional has a value, optional entries read None elsewhere.
+    series = []
+    for entry in pairs:
+        pair, source = (entry, None) if isinstance(entry, str) else entry
+        series.append(dict(read_pair(conn, pair, source, start, end)))
+    required = [s for entry, s in zip(pairs, series) if entry not in optional]
+    if required:
+        days = sorted(set(required[0]).intersection(*required[1:]))
+    else:
+        days = sorted(set().union(*series))
+    return days, [[s.get(d) for d in days] for s in series]
+
+
+def table_columns(conn: sqlite3.Connection, schema_name: str, table: str):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema_name}.table_info({table})")]
+
+
+def copy_table(conn: sqlite3.Connection, table: str, src: str, dst: str) -> int:
+    # Copies by column name, so files whose columns were added in a different
+    # order still line up. Rows already in dst win.
+    cols = ", ".join(table_columns(conn, src, table))
+    cur = conn.execute(f"INSERT OR IGNORE INTO {dst}.{table} ({cols}) SELECT {cols} FROM {src}.{table}")
+    return cur.rowcount
+
+
+def import_legacy(conn: sqlite3.Connection, legacy_dir: str, verbose: bool = False) -> int:
+    # Copy goldprice.db, silverprice.db and GSPLN.db into the store. Each file
+    # is first brought to its latest per-file schema. Importing twice is harmless.
+    store_payloads = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == schema.PAYLOADS_SCHEMA)
+    imported = 0
+    sources = [(os.path.join(legacy_dir, name), schema.METAL_MIGRATIONS, {"metal": metal}) for metal, name in LEGACY_METAL_DBS.items()]
+    sources.append((os.path.join(legacy_dir, LEGACY_GSP_DB), schema.GSP_MIGRATIONS, {}))
+    for path, migrations, ctx in sources:
+        if not os.path.exists(path):
+            continue
+        legacy_payloads = payloads_path_for(path)
+        day = schema.iso_to_day_sql("date")
+        legacy = sqlite3.connect(path)
+        try:
+            if "metal" in ctx:
+                schema.attach_payloads(legacy, legacy_payloads, verbose)
+            schema.migrate(legacy, migrations, verbose, **ctx)
+        finally:
+            legacy.close()
+        conn.execute("ATTACH DATABASE ? AS legacy", (path,))
+        try:
+            if "metal" in ctx:
+                cur = conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO metal_prices (day, base, symbol, rate, source, raw_hash)
+                    SELECT {day}, base, symbol, rate, source, raw_hash FROM legacy.metal_prices
+                    """
+                )
+                rows = cur.rowcount
+                schema.quotes_from_metal_prices(conn, "legacy", day)
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO fetch_failures
+                    SELECT {day}, base, symbol, source, error_class, code, info, failed_at, expires_at FROM legacy.fetch_failures
+                    """
+                )
+                # Payloads archived next to the legacy file, if that is not the
+                # store's own archive, come along so raw_hash still resolves.
+                if os.path.abspath(legacy_payloads) != os.path.abspath(store_payloads) and os.path.exists(legacy_payloads):
+                    conn.commit()
+                    conn.execute("ATTACH DATABASE ? AS legacy_payloads", (legacy_payloads,))
+                    try:
+                        copy_table(conn, "raw_payloads", "legacy_payloads", schema.PAYLOADS_SCHEMA)
+                        conn.commit()
+                    finally:
+                        conn.execute("DETACH DATABASE legacy_payloads")
+            else:
+                rows = schema.quotes_from_gsp(conn, "legacy", day)
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO fx_coverage (pair, first_day, last_day)
+                    SELECT pair, {schema.iso_to_day_sql('first_date')}, {schema.iso_to_day_sql('last_date')} FROM legacy.fx_coverage
+                    """
+                )
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO gsp_meta (key, value)
+                    SELECT key, CASE WHEN key = 'complete_through' THEN {schema.iso_to_day_sql('value')} ELSE value END FROM legacy.gsp_meta
+                    """
+                )
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE legacy")
+        imported += rows
+        if verbose:
+            print(f"Imported {rows} row(s) from {path}", file=sys.stderr)
+    return imported
+
+
+def write_legacy(conn: sqlite3.Connection, path: str, migrations, fill, **ctx):
+    # Build the file from scratch under a temp name and swap it in. The same
+    # content always yields the same bytes, so git only sees real changes.
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    out = sqlite3.connect(tmp)
+    try:
+        if "metal" in ctx:
+            schema.attach_payloads(out, payloads_path_for(path))
+        schema.migrate(out, migrations, **ctx)
+    finally:
+        out.close()
+    conn.execute("ATTACH DATABASE ? AS legacy", (tmp,))
+    try:
+        fill()
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+    os.replace(tmp, path)
+
+
+def export_legacy(conn: sqlite3.Connection, out_dir: str, verbose: bool = False):
+    for metal, name in LEGACY_METAL_DBS.items():
+        path = os.path.join(out_dir, name)
+
+        def fill(metal=metal):
+            conn.execute(
+                f"""
+                INSERT INTO legacy.metal_prices (date, base, symbol, rate, {metal.lower()}usd, source, raw_hash)
+                SELECT {schema.day_to_iso_sql('m.day')}, m.base, m.symbol, m.rate, q.value, m.source, m.raw_hash
+                FROM metal_prices m
+                LEFT JOIN quotes q
+                  ON q.pair = ? AND q.day = m.day AND q.source = m.source AND 'USD' IN (m.base, m.symbol)
+                WHERE m.symbol = ? OR m.base = ?
+                ORDER BY m.day, m.base, m.symbol, m.source
+                """,
+                (f"{metal}USD", metal, metal),
+            )
+            conn.execute(
+                """
+                INSERT INTO legacy.fetch_failures SELECT * FROM fetch_failures_iso
+                WHERE symbol = ? OR base = ?
+                ORDER BY date, base, symbol, source
+                """,
+                (metal, metal),
+            )
+
+        write_legacy(conn, path, schema.METAL_MIGRATIONS, fill, metal=metal)
+        if verbose:
+            print(f"Exported {path}", file=sys.stderr)
+
+    def fill_gsp():
+        # Pivot the quotes back into the wide gsp layout.
+        days, cols = pivot(
+            conn,
+            ["XAUUSD", "XAGUSD", ("XAUXAG", DERIVED_SOURCE), ("USDPLN", DERIVED_SOURCE), ("XAUPLN", DERIVED_SOURCE), ("XAGPLN", DERIVED_SOURCE)],
+            optional=(("USDPLN", DERIVED_SOURCE), ("XAUPLN", DERIVED_SOURCE), ("XAGPLN", DERIVED_SOURCE)),
+        )
+        conn.executemany(
+            "INSERT INTO legacy.gsp (date, xauusd, xagusd, gsr, usdpln, xaupln, xagpln) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((schema.from_day(d),) + row for d, row in zip(days, zip(*cols))),
+        )
+        conn.execute(
+            "INSERT INTO legacy.fx_rates (date, pair, rate) SELECT date, pair, value FROM quotes_iso WHERE pair = ? AND source = ? ORDER BY date",
+            (nbp.USDPLN, nbp.SOURCE),
+        )
+        conn.execute("INSERT INTO legacy.fx_coverage SELECT * FROM fx_coverage_iso")
+        conn.execute(
+            f"""
+            INSERT INTO legacy.gsp_meta (key, value)
+            SELECT key, CASE WHEN key = 'complete_through' THEN {schema.day_to_iso_sql('value')} ELSE value END FROM gsp_meta
+            """
+        )
+
+    path = os.path.join(out_dir, LEGACY_GSP_DB)
+    write_legacy(conn, path, schema.GSP_MIGRATIONS, fill_gsp)
+    if verbose:
+        print(f"Exported {path}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the consolidated gypstats.db store")
+    parser.add_argument(
+        "command",
+        choices=("import", "export", "checkpoint"),
+        help="import: copy the per-file DBs into the store; export: rewrite them from it; checkpoint: fold the WAL into the store",
+    )
+    parser.add_argument("--db", default=STORE_FILENAME, help=f"Store path (default: {STORE_FILENAME})")
+    parser.add_argument("--legacy-dir", default="", help="Directory of goldprice.db/silverprice.db/GSPLN.db (default: the store's directory)")
+    parser.add_argument("--quiet", action="store_true", help="Disable verbose output")
+    args = parser.parse_args(argv)
+    verbose = not args.quiet
+    legacy_dir = args.legacy_dir or os.path.dirname(os.path.abspath(args.db))
+
+    conn = connect(args.db, verbose)
+    try:
+        if args.command == "import":
+            import_legacy(conn, legacy_dir, verbose)
+        elif args.command == "export":
+            export_legacy(conn, legacy_dir, verbose)
+        checkpoint(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
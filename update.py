@@ -4,57 +4,45 @@ import re
 import sqlite3
 import subprocess
 import sys
+import time
 from datetime import date, datetime, timedelta
 
-MIN_DATE = date(2026, 1, 2)
+import matplotlib
 
+# Plots are rendered off the main thread and only ever saved to files.
+matplotlib.use("Agg")
 
-def get_latest_date(db_path: str):
-    if not os.path.exists(db_path):
-        return None
-    conn = sqlite3.connect(db_path)
-    try:
-        cur = conn.execute("SELECT MAX(date) FROM metal_prices")
-        row = cur.fetchone()
-    finally:
-        conn.close()
-    if not row or not row[0]:
-        return None
-    try:
-        return datetime.strptime(row[0], "%Y-%m-%d").date()
-    except ValueError:
-        return None
+import httpclient
+import metalprice
+import nbp
+import plot
+import quota
+import schema
+import stages
+import store
 
+MIN_DATE = date(2026, 1, 2)
+METALS = (("XAU", "Gold"), ("XAG", "Silver"))
 
-def run_range(script_path: str, start_dt: date, end_dt: date):
-    if end_dt < start_dt:
-        return
-    cmd = [sys.executable, script_path, "--start", start_dt.strftime("%Y-%m-%d"), "--end", end_dt.strftime("%Y-%m-%d")]
-    print("Running:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
 
-def update_index_html(repo_dir: str, gspln_db: str):
-    if not os.path.exists(gspln_db):
-        print("GSPLN.db not found; skipping index update.")
-        return
-    conn = sqlite3.connect(gspln_db)
-    try:
-        cur = conn.execute(
-            """
-            SELECT date, xauusd, xagusd, xaupln, xagpln
-            FROM gsp
-            WHERE xauusd IS NOT NULL AND xagusd IS NOT NULL
-            ORDER BY date DESC
-            LIMIT 1
-            """
-        )
-        row = cur.fetchone()
-    finally:
-        conn.close()
-    if not row:
-        print("No data in GSPLN.db; skipping index update.")
+def find_gaps(conn: sqlite3.Connection, start_dt: date, end_dt: date):
+    # {symbol: [missing day numbers]} over [start, end] for every tracked metal,
+    # holes inside the history included.
+    now = int(time.time())
+    return {
+        symbol: store.missing_days(conn, metalprice.DEFAULT_BASE, symbol, metalprice.SOURCE, schema.to_day(start_dt), schema.to_day(end_dt), now)
+        for symbol, _ in METALS
+    }
+
+
+def update_index_html(repo_dir: str, joined):
+    # joined is plot.load()'s ["joined"] series: the newest row feeds the page.
+    days, xauusd, xagusd, xaupln, xagpln = joined
+    if not days:
+        print("No XAUUSD/XAGUSD data in the store; skipping index update.")
         return
-    last_date, xauusd, xagusd, xaupln, xagpln = row
+    last_date = schema.from_day(days[-1])
+    xauusd, xagusd, xaupln, xagpln = xauusd[-1], xagusd[-1], xaupln[-1], xagpln[-1]
     index_path = os.path.join(repo_dir, "index.html")
     if not os.path.exists(index_path):
         print("index.html not found; skipping index update.")
@@ -92,8 +80,9 @@ def git_sync(repo_dir: str):
     def run(cmd):
         subprocess.run(cmd, check=True, cwd=repo_dir)
 
-    # Stage only DBs, plots, and index page
-    run(["git", "add", "goldprice.db", "silverprice.db", "GSPLN.db", "plots/", "index.html"])
+    # Stage only DBs (the store, its payload archive and the exported legacy
+    # files), plots, and index page
+    run(["git", "add", store.STORE_FILENAME, "payloads.db", "goldprice.db", "silverprice.db", "GSPLN.db", "plots/", "index.html"])
     # Commit only if there are staged changes
     status = subprocess.run(["git", "diff", "--cached", "--quiet"], cwd=repo_dir)
     if status.returncode == 0:
@@ -103,12 +92,19 @@ def git_sync(repo_dir: str):
     run(["git", "commit", "-m", f"Update data and plots ({stamp})"])
     run(["git", "push"])
 
+def open_store(store_path: str, fn):
+    # Stages run on their own threads, so each gets its own store connection;
+    # WAL lets them read side by side and busy_timeout queues their writes.
+    conn = store.connect(store_path)
+    try:
+        return fn(conn)
+    finally:
+        conn.close()
+
+
 def main():
     here = os.path.dirname(__file__)
-    gold_script = os.path.join(here, "goldprice.py")
-    silver_script = os.path.join(here, "silverprice.py")
-    gold_db = os.path.join(here, "goldprice.db")
-    silver_db = os.path.join(here, "silverprice.db")
+    store_path = os.path.join(here, store.STORE_FILENAME)
 
     # MetalpriceAPI "yesterday" aligns to UTC, so use UTC date here.
     yesterday = datetime.utcnow().date() - timedelta(days=1)
@@ -116,32 +112,81 @@ def main():
         print("Yesterday is before MIN_DATE; nothing to do.")
         return
 
-    # Gold
-    gold_latest = get_latest_date(gold_db)
-    gold_start = MIN_DATE if not gold_latest else gold_latest + timedelta(days=1)
-    if gold_start <= yesterday:
-        run_range(gold_script, gold_start, yesterday)
-    else:
-        print("Gold: already up to date.")
-
-    # Silver
-    silver_latest = get_latest_date(silver_db)
-    silver_start = MIN_DATE if not silver_latest else silver_latest + timedelta(days=1)
-    if silver_start <= yesterday:
-        run_range(silver_script, silver_start, yesterday)
-    else:
-        print("Silver: already up to date.")
-
-    # Refresh plots
-    plot_script = os.path.join(here, "plot.py")
-    cmd = [sys.executable, plot_script]
-    print("Running:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
-    update_index_html(here, os.path.join(here, "GSPLN.db"))
-
-    # Push DBs + plots to GitHub
-    git_sync(here)
+    # First run on the consolidated store: bring in the per-file DBs (and run
+    # every migration) before any stage opens it.
+    first_run = not os.path.exists(store_path)
+    conn = store.connect(store_path, verbose=True)
+    try:
+        if first_run:
+            store.import_legacy(conn, here, verbose=True)
+    finally:
+        conn.close()
 
+    def ingest_metals(conn):
+        # Every day since MIN_DATE that some metal lacks (not just the days after
+        # the newest one) is planned into as few bulk requests as possible, shared
+        # across metals, and fetched in one ingest pass.
+        gaps = find_gaps(conn, MIN_DATE, yesterday)
+        missing = {}
+        for symbol, name in METALS:
+            days = gaps[symbol]
+            if days:
+                print(f"{name}: {len(days)} missing day(s) since {MIN_DATE}, first {schema.from_day(days[0])}.")
+            else:
+                print(f"{name}: already up to date.")
+            for d in days:
+                missing.setdefault(schema.from_day(d), []).append(symbol)
+        if missing:
+            plan = metalprice.plan_requests(missing, [symbol for symbol, _ in METALS if gaps[symbol]])
+            print(f"Plan: {len(missing)} day(s) in {len(plan)} bulk request(s).")
+        # The revalidation window (up to yesterday) always goes through
+        # ingest(): stored prices there that were fetched before their day
+        # closed are fetched again, settled ones are served from the store.
+        first, _ = metalprice.revalidation_window(int(time.time()))
+        recent = [schema.from_day(d) for d in range(first, schema.to_day(yesterday) + 1)]
+        session = metalprice.IngestSession(store_path, True, conn=conn)
+        try:
+            metalprice.ingest(session, sorted(set(missing) | set(recent)), [symbol for symbol, _ in METALS])
+        finally:
+            session.close()
+
+    def ingest_fx(conn):
+        # The fixings the gsp rebuild will look up, fetched alongside the metals.
+        start = nbp.last_fixing_date(MIN_DATE.isoformat())
+        nbp.sync_usdpln(conn, start, yesterday.isoformat(), verbose=True)
+
+    def export(conn):
+        # Rewrite the legacy per-file DBs linked from index.html, and fold the WAL
+        # into the store so the committed file is complete.
+        store.export_legacy(conn, here, verbose=True)
+        store.checkpoint(conn)
+
+    def snapshot(conn):
+        # Every run records the current quotes; days that have closed since
+        # are rolled up before the metals stage looks for gaps.
+        metalprice.take_snapshot(conn, [symbol for symbol, _ in METALS], verbose=True)
+
+    # Metals and fixings are independent; the gsp rebuild needs both, and the
+    # plots, index page and legacy export all start from its series.
+    stages.run_stages([
+        ("snapshot", (), lambda r: open_store(store_path, snapshot)),
+        ("metals", ("snapshot",), lambda r: open_store(store_path, ingest_metals)),
+        ("fx", (), lambda r: open_store(store_path, ingest_fx)),
+        ("gsp", ("metals", "fx"), lambda r: open_store(store_path, lambda conn: plot.load(conn, verbose=True))),
+        ("plots", ("gsp",), lambda r: plot.render(r["gsp"])),
+        ("index", ("gsp",), lambda r: update_index_html(here, r["gsp"]["joined"])),
+        ("export", ("gsp",), lambda r: open_store(store_path, export)),
+        # Push DBs + plots to GitHub
+        ("git", ("plots", "index", "export"), lambda r: git_sync(here)),
+    ])
+    print(httpclient.get_client().summary(), file=sys.stderr)
+    conn = store.connect(store_path)
+    try:
+        for provider in (metalprice.SOURCE, nbp.SOURCE):
+            on_day, in_month = quota.usage(conn, provider)
+            print(f"Quota: {provider} {on_day} request(s) today, {in_month} this month (UTC).")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     main()